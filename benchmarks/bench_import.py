@@ -0,0 +1,110 @@
+"""
+Время импорта sphinx-autotoc.
+
+Запускает интерпретатор с -X importtime и замеряет время импорта расширения и модулей,
+которые оно загружает сверх самого Sphinx, и сохраняет результаты в JSON, чтобы сравнивать
+их между версиями::
+
+    python benchmarks/bench_import.py -o import.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from sphinx_autotoc import __version__
+
+SPHINX_MODULES = ('sphinx.application', 'sphinx.config', 'sphinx.errors', 'sphinx.util.logging')
+"""Модули Sphinx, которые загружаются до расширения при любом запуске sphinx-build."""
+
+
+def import_times(
+    module: str = 'sphinx_autotoc', preload: Sequence[str] = SPHINX_MODULES, repeat: int = 3
+) -> Dict[str, Any]:
+    """
+    Замеряет время импорта модуля в отдельном интерпретаторе.
+
+    Скомпилированные модули сохраняются во временную папку, поэтому первый запуск
+    компилирует модули, а следующие - нет.
+
+    :param module: Импортируемый модуль.
+    :param preload: Модули, импортируемые заранее. Их время и время их зависимостей
+        не учитывается.
+    :param repeat: Число запусков.
+    :return: Время импорта модуля вместе с зависимостями (total, мкс) и собственное время
+        импорта каждого загруженного им модуля (modules, мкс) в самом быстром запуске.
+    """
+    code = ''.join(f'import {name}\n' for name in [*preload, module])
+    with tempfile.TemporaryDirectory() as pycache:
+        env = dict(os.environ, PYTHONPYCACHEPREFIX=pycache)
+        env.pop('PYTHONDONTWRITEBYTECODE', None)
+        runs = [
+            _parse_importtime(
+                subprocess.run(
+                    [sys.executable, '-X', 'importtime', '-c', code],
+                    capture_output=True,
+                    check=True,
+                    env=env,
+                    text=True,
+                ).stderr,
+                module,
+            )
+            for _ in range(repeat)
+        ]
+    return min(runs, key=lambda run: run['total'])
+
+
+def _parse_importtime(output: str, module: str) -> Dict[str, Any]:
+    """
+    :param output: Вывод -X importtime. Модуль выводится после всех модулей, которые он
+        загрузил, строкой без отступа.
+    :param module: Модуль, импортированный последним.
+    :return: Время импорта модуля и загруженных им модулей.
+    """
+    modules: Dict[str, int] = {}
+    total = 0
+    for line in output.splitlines():
+        if not line.startswith('import time:') or line.endswith('imported package'):
+            continue
+        self_time, cumulative, name = line[len('import time:') :].split('|')
+        if not name.startswith('  '):
+            # Модуль верхнего уровня: загруженные до него модули относятся к предыдущему
+            # импорту
+            if name.strip() == module:
+                modules[module] = int(self_time)
+                total = int(cumulative)
+                break
+            modules.clear()
+            continue
+        modules[name.strip()] = int(self_time)
+    return {'total': total, 'modules': modules}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeat', type=int, default=5, help='число запусков')
+    parser.add_argument('-o', '--output', type=Path, help='файл для результатов в формате JSON')
+    args = parser.parse_args(argv)
+
+    result = {
+        'version': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {'preload': list(SPHINX_MODULES), 'repeat': args.repeat},
+        **import_times(repeat=args.repeat),
+    }
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        args.output.write_text(output + '\n', encoding='utf8')
+    print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
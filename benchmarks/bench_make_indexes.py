@@ -0,0 +1,238 @@
+"""
+Бенчмарк sphinx-autotoc на синтетических деревьях документации.
+
+Генерирует папку src заданной глубины и ширины, замеряет время отдельных этапов
+(make_indexes, _list_files, _iter_dirs, разбор autosummary) и пиковый объём памяти
+(make_indexes, _scan_tree) и сохраняет результаты в JSON, чтобы сравнивать их между
+версиями::
+
+    python benchmarks/bench_make_indexes.py --depth 3 --fanout 10 --files 10 -o result.json
+"""
+
+import argparse
+import json
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from sphinx.config import Config
+
+from sphinx_autotoc import (
+    AUTOSUMMARY_FILE_NAME,
+    CONFIG_VALUES,
+    __version__,
+    _collect_autosummary,
+    _iter_dirs,
+    _list_files,
+    _scan_tree,
+    make_indexes,
+)
+from sphinx_autotoc._snapshot import empty_snapshot
+
+AUTOSUMMARY_FILE = """{header}
+==========
+
+.. autosummary::
+   :toctree: _autosummary
+   :recursive:
+
+   {module}
+"""
+
+
+def generate_tree(
+    root: Path,
+    depth: int,
+    fanout: int,
+    files: int,
+    max_files: int = 100_000,
+    readme: bool = False,
+    autosummary: bool = False,
+) -> int:
+    """
+    Создаёт синтетическую папку src.
+
+    :param root: Папка с документацией, в ней создаётся папка src.
+    :param depth: Глубина вложенности папок.
+    :param fanout: Число вложенных папок в каждой папке.
+    :param files: Число файлов .rst в каждой папке.
+    :param max_files: Наибольшее число файлов .rst в дереве.
+    :param readme: Добавлять ли в каждую папку README.md.
+    :param autosummary: Добавлять ли в каждую папку файл autotoc.autosummary.rst.
+    :return: Число созданных файлов .rst.
+    """
+    created = 0
+    level = [root / 'src']
+    for current_depth in range(depth + 1):
+        next_level: List[Path] = []
+        for folder in level:
+            folder.mkdir(parents=True, exist_ok=True)
+            if readme:
+                (folder / 'README.md').write_text(f'{folder.name}\n', encoding='utf8')
+            if autosummary and folder != root / 'src':
+                content = AUTOSUMMARY_FILE.format(header=folder.name, module=f'm{created}')
+                (folder / 'autotoc.autosummary.rst').write_text(content, encoding='utf8')
+            for i in range(files):
+                if created >= max_files:
+                    return created
+                (folder / f'{i}. page.rst').write_text(f'Page {i}\n=======\n', encoding='utf8')
+                created += 1
+            if current_depth < depth:
+                next_level.extend(folder / f'{i}. folder' for i in range(fanout))
+        level = next_level
+    return created
+
+
+def make_config(autosummary: bool) -> Config:
+    extensions = ['sphinx.ext.autosummary'] if autosummary else []
+    cfg = Config(
+        {
+            'project': 'Benchmark',
+            'extensions': extensions,
+            'source_suffix': {'.rst': 'restructuredtext', '.md': 'markdown'},
+        },
+        {},
+    )
+    cfg.init_values()
+    for name, default, rebuild, types in CONFIG_VALUES:
+        cfg.add(name, default, rebuild, types)
+    cfg.add('autosummary_generate', autosummary, 'html', bool)
+    return cfg
+
+
+def measure(func: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    """
+    :param func: Замеряемая функция.
+    :param repeat: Число запусков.
+    :return: Наименьшее, среднее и медианное время запуска (с).
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {
+        'min': min(timings),
+        'mean': statistics.mean(timings),
+        'median': statistics.median(timings),
+    }
+
+
+def measure_memory(func: Callable[[], Any]) -> int:
+    """
+    :param func: Замеряемая функция.
+    :return: Пиковый объём памяти, выделенной во время запуска (байт).
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(
+    depth: int,
+    fanout: int,
+    files: int,
+    max_files: int = 100_000,
+    readme: bool = False,
+    autosummary: bool = False,
+    repeat: int = 3,
+    workdir: Optional[Path] = None,
+) -> Dict[str, Any]:
+    """
+    Генерирует дерево и замеряет этапы формирования содержания.
+
+    :return: Параметры запуска и результаты замеров.
+    """
+    tmp = Path(tempfile.mkdtemp(dir=workdir))
+    try:
+        total_files = generate_tree(tmp, depth, fanout, files, max_files, readme, autosummary)
+        cfg = make_config(autosummary)
+        exclude_patterns = cfg['exclude_patterns']
+        source_suffix = cfg['source_suffix']
+        tree = _scan_tree(tmp, exclude_patterns, source_suffix)
+        nodes = list(_iter_dirs(tree))
+        results = {
+            'make_indexes': measure(lambda: make_indexes(tmp, cfg), repeat),
+            '_list_files': measure(
+                lambda: _list_files(tmp, exclude_patterns, source_suffix), repeat
+            ),
+            '_iter_dirs': measure(lambda: list(_iter_dirs(tree)), repeat),
+            # Без снимка предыдущей сборки, то есть с разбором каждого файла
+            'autosummary': measure(
+                lambda: _collect_autosummary(
+                    tmp, nodes, AUTOSUMMARY_FILE_NAME, {}, empty_snapshot('')
+                ),
+                repeat,
+            ),
+        }
+        peak_memory = {
+            'make_indexes': measure_memory(lambda: make_indexes(tmp, cfg)),
+            '_scan_tree': measure_memory(lambda: _scan_tree(tmp, exclude_patterns, source_suffix)),
+        }
+    finally:
+        shutil.rmtree(tmp)
+
+    return {
+        'version': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {
+            'depth': depth,
+            'fanout': fanout,
+            'files': files,
+            'max_files': max_files,
+            'readme': readme,
+            'autosummary': autosummary,
+            'repeat': repeat,
+        },
+        'total_files': total_files,
+        'results': results,
+        'peak_memory': peak_memory,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--depth', type=int, default=3, help='глубина вложенности папок')
+    parser.add_argument('--fanout', type=int, default=5, help='число вложенных папок')
+    parser.add_argument('--files', type=int, default=10, help='число файлов в папке')
+    parser.add_argument(
+        '--max-files', type=int, default=100_000, help='наибольшее число файлов в дереве'
+    )
+    parser.add_argument('--readme', action='store_true', help='добавить README.md в папки')
+    parser.add_argument(
+        '--autosummary', action='store_true', help='добавить autotoc.autosummary.rst в папки'
+    )
+    parser.add_argument('--repeat', type=int, default=3, help='число запусков каждого этапа')
+    parser.add_argument('--workdir', type=Path, help='папка для синтетического дерева')
+    parser.add_argument('-o', '--output', type=Path, help='файл для результатов в формате JSON')
+    args = parser.parse_args(argv)
+
+    result = run(
+        args.depth,
+        args.fanout,
+        args.files,
+        args.max_files,
+        args.readme,
+        args.autosummary,
+        args.repeat,
+        args.workdir,
+    )
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        args.output.write_text(output + '\n', encoding='utf8')
+    print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
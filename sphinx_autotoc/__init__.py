@@ -1,25 +1,77 @@
+import fnmatch
+import hashlib
+import itertools
+import json
 import os
-from collections import defaultdict
-from pathlib import Path
-from typing import Dict, Iterator, List, Set, Tuple, Union
+import posixpath
+import sys
+import time
+from functools import lru_cache, partial
+from pathlib import Path, PurePosixPath
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
-from natsort import natsorted
 from sphinx.application import Sphinx
 from sphinx.config import Config
 from sphinx.errors import ExtensionError
 from sphinx.util import logging
-from sphinx.util.matching import Matcher
+
+from sphinx_autotoc._exclude import ExcludeMatcher
+from sphinx_autotoc._git import git_files
+from sphinx_autotoc._names import dir_page_stem, is_generated_stem, shard_page_stem
+from sphinx_autotoc._outdated import get_ancestor_pages, get_changed_pages, track_pages
+from sphinx_autotoc._snapshot import (
+    MTIME_GRANULARITY_NS,
+    DirRecord,
+    FileSignature,
+    Snapshot,
+    empty_snapshot,
+    file_signature,
+    load_snapshot,
+    save_snapshot,
+)
+from sphinx_autotoc._virtual import (
+    add_virtual_docs,
+    hide_virtual_source,
+    read_virtual_doc,
+    register_pages,
+)
+
+# Модули, которые нужны только при формировании содержания, импортируются в функциях:
+# расширение загружается и при запусках Sphinx, не доходящих до builder-inited
+# (sphinx-build -M help и т. п.)
+if TYPE_CHECKING:
+    from sphinx_autotoc._stats import IndexStats
+    from sphinx_autotoc._watch import TreeWatcher
+
+__version__ = '0.1'
 
 logger = logging.getLogger(__name__)
 SPHINX_SERVICE_FILE_PREFIX = 'autotoc'
 SPHINX_INDEX_FILE_NAME = 'autotoc.rst'
+AUTOSUMMARY_FILE_NAME = 'autotoc.autosummary.rst'
+PREGENERATED_CACHE_DIR = '.sphinx_autotoc'
+"""Папка в папке с документацией для снимка команды python -m sphinx_autotoc."""
 NAV_PATTERN = """
 {dirname}
 ==========
 {includes}
 
 .. toctree::
-   :maxdepth: 2
+   {options}
 
    {search_paths}
 """
@@ -28,69 +80,676 @@ MAIN_PAGE = """
 {project}
 ==================={dop}="""
 
+CONFIG_VALUES: List[Tuple[str, Any, str, Any]] = [
+    ('sphinx_autotoc_trim_folder_numbers', False, 'html', bool),
+    ('sphinx_autotoc_get_headers_from_subfolder', False, 'html', bool),
+    ('sphinx_autotoc_header', 'Содержание', 'html', str),
+    ('sphinx_autotoc_virtual_pages', False, 'env', bool),
+    ('sphinx_autotoc_workers', 1, '', int),
+    ('sphinx_autotoc_stats_file', '', '', str),
+    ('sphinx_autotoc_watch', '', '', str),
+    ('sphinx_autotoc_shard_size', 0, 'env', int),
+    ('sphinx_autotoc_shard_mode', 'size', 'env', str),
+    ('sphinx_autotoc_maxdepth', 2, 'env', int),
+    ('sphinx_autotoc_level_maxdepth', {}, 'env', dict),
+    ('sphinx_autotoc_dir_maxdepth', {}, 'env', dict),
+    ('sphinx_autotoc_titlesonly', False, 'env', bool),
+    ('sphinx_autotoc_toctree_budget', 0, 'env', int),
+    ('sphinx_autotoc_readme_mode', 'inline', 'env', str),
+    ('sphinx_autotoc_autosummary_pattern', AUTOSUMMARY_FILE_NAME, 'env', str),
+    ('sphinx_autotoc_pregenerated', False, '', bool),
+    ('sphinx_autotoc_roots', [], 'env', list),
+    ('sphinx_autotoc_processes', 0, '', int),
+    ('sphinx_autotoc_profile', '', '', str),
+    ('sphinx_autotoc_git_index', False, '', bool),
+]
+"""Параметры конфигурации расширения: имя, значение по умолчанию, область пересборки, типы."""
+
+
+SHARD_MODES = ('size', 'alpha')
+README_MODES = ('inline', 'include')
+
+T = TypeVar('T')
+R = TypeVar('R')
+
 TOCTREE = """
 .. toctree::
-   :maxdepth: 2
+   {options}
    :caption: {group_name}
 
    {group_dirs}
 """
 
 
+class TocOptions(NamedTuple):
+    """Параметры toctree в сервисных файлах."""
+
+    maxdepth: int = 2
+    """Глубина toctree по умолчанию."""
+    level_maxdepth: Dict[int, int] = {}
+    """Глубина toctree на страницах уровня (0 - индексная страница, 1 - папки в src и т. д.)."""
+    dir_maxdepth: Dict[str, int] = {}
+    """Глубина toctree для папок (путь к папке относительно папки с документацией)."""
+    titlesonly: bool = False
+    """Показывать в toctree только заголовки страниц, без разделов."""
+    budget: int = 0
+    """Наибольшее число ссылок в развёрнутом toctree, 0 - без ограничения."""
+    shard_size: int = 0
+    """Наибольшее число ссылок на файлы в сервисном файле (sphinx_autotoc_shard_size)."""
+
+
+class DocRoot(NamedTuple):
+    """Папка с исходными файлами документации (элемент sphinx_autotoc_roots)."""
+
+    path: str = 'src'
+    """Путь к папке относительно папки с документацией в формате posix."""
+    caption: str = 'Содержание'
+    """Заголовок содержания папки на индексной странице."""
+    trim_folder_numbers: bool = False
+    """Удалять ли номера папок."""
+    get_headers_from_subfolder: bool = False
+    """Выводить ли вложенные папки на индексной странице отдельными содержаниями."""
+
+
+class BuildOptions(NamedTuple):
+    """Параметры формирования сервисных файлов, общие для всех корней."""
+
+    docs_directory: Path
+    exclude_patterns: List[str]
+    source_suffixes: Union[List[str], Dict[str, str]]
+    readme_mode: str
+    autosummary_flag: bool
+    autosummary_pattern: str
+    shard_mode: str
+    toc_options: TocOptions
+    workers: int
+
+
+class RootTask(NamedTuple):
+    """Корень и сведения о нём из предыдущей сборки."""
+
+    root: DocRoot
+    previous: Snapshot
+    """Снимок предыдущей сборки, в котором оставлены только папки и файлы корня (кроме
+    записанных сервисных файлов: по их хэшам находятся перенесённые файлы)."""
+    cached: bool
+    """Использовать ли снимок при обходе."""
+    skip_unchanged: bool
+    """Не формировать сервисные файлы, если корень не изменился с предыдущей сборки."""
+    dirty: Optional[Set[str]]
+    """Изменившиеся папки по данным отслеживания или None, если они неизвестны."""
+    reusable_pages: Optional[Dict[Path, str]]
+    """Сервисные файлы корня из предыдущей сборки, хранящиеся в памяти."""
+
+
+class RootResult(NamedTuple):
+    """Результат обхода и формирования сервисных файлов корня."""
+
+    dir_records: Dict[str, DirRecord]
+    inputs: Dict[str, FileSignature]
+    pages: Optional[Dict[Path, str]]
+    """Сервисные файлы папок в порядке обхода или None, если корень не изменился и файлы не
+    формировались."""
+    main_page: str
+    """Содержания корня на индексной странице."""
+    readmes: Dict[str, str]
+    """Содержимое файлов README для снимка."""
+    autosummary: Dict[str, Tuple[str, str]]
+    """Сведения о файлах с директивой autosummary для снимка."""
+    stats: 'IndexStats'
+
+
+class DirNode:
+    """
+    Папка в дереве документации.
+
+    В дерево попадают только папки, в которых (или во вложенных папках которых) есть
+    исходные файлы документации.
+
+    Деревья больших проектов содержат сотни тысяч файлов, поэтому у узлов нет __dict__,
+    а файлы хранятся не объектами Path, а именами: тем же списком строк, что и в снимке
+    (DirRecord.files).
+    """
+
+    __slots__ = ('path', 'dirs', 'files', 'has_readme')
+
+    def __init__(
+        self, path: Path, dirs: List['DirNode'], files: List[str], has_readme: bool = False
+    ) -> None:
+        self.path = path
+        """Полный путь к папке."""
+        self.dirs = dirs
+        """Вложенные папки."""
+        self.files = files
+        """Имена исходных файлов документации в папке в естественном порядке. Список общий
+        со снимком, поэтому не изменяется, а заменяется."""
+        self.has_readme = has_readme
+        """Есть ли в папке файл README.md."""
+
+    def __repr__(self) -> str:
+        return f'DirNode({self.path!r}, {len(self.dirs)} dirs, {len(self.files)} files)'
+
+
 def run_make_indexes(app: Sphinx) -> None:
+    from sphinx_autotoc._profile import profile
+    from sphinx_autotoc._stats import IndexStats
+    from sphinx_autotoc._watch import get_watcher
+
     logger.info('Running make_indexes...')
     app.config['root_doc'] = 'autotoc'
-    make_indexes(Path(app.srcdir), app.config)
-
-
-def setup(app: Sphinx) -> None:
-    app.add_config_value('sphinx_autotoc_trim_folder_numbers', False, 'html', bool)
-    app.add_config_value('sphinx_autotoc_get_headers_from_subfolder', False, 'html', bool)
-    app.add_config_value('sphinx_autotoc_header', 'Содержание', 'html', str)
+    virtual_pages = app.config['sphinx_autotoc_virtual_pages']
+    stats = IndexStats()
+    srcdir = Path(app.srcdir)
+    pages: Dict[Path, str] = {}
+    with profile(app.config['sphinx_autotoc_profile'], Path(app.outdir)):
+        if (
+            app.config['sphinx_autotoc_pregenerated']
+            and not virtual_pages
+            and _pregenerated_unchanged(srcdir, app.config, stats)
+        ):
+            logger.info('make_indexes: pregenerated pages are up to date, skipping')
+        else:
+            pages = make_indexes(
+                srcdir,
+                app.config,
+                Path(app.doctreedir),
+                write=not virtual_pages,
+                stats=stats,
+                watcher=get_watcher(srcdir, app.config['sphinx_autotoc_watch']),
+            )
+        register_pages(app, pages if virtual_pages else {})
+        track_pages(app, pages)
+    app.emit('autotoc-stats', stats)
+    stats_file = app.config['sphinx_autotoc_stats_file']
+    if stats_file:
+        with open(Path(app.outdir) / stats_file, 'w', encoding='utf8') as f:
+            json.dump(stats.as_dict(), f, indent=2)
+
+
+def setup(app: Sphinx) -> Dict[str, Any]:
+    for name, default, rebuild, types in CONFIG_VALUES:
+        app.add_config_value(name, default, rebuild, types)
+    app.add_event('autotoc-stats')
     app.connect('builder-inited', run_make_indexes, 250)
+    app.connect('env-get-outdated', add_virtual_docs)
+    app.connect('env-get-outdated', get_changed_pages)
+    app.connect('env-get-updated', get_ancestor_pages)
+    app.connect('source-read', read_virtual_doc)
+    app.connect('html-page-context', hide_virtual_source)
+    # Все файлы формируются в builder-inited, до начала чтения документов, а виртуальные
+    # документы сохраняются в окружении до чтения, поэтому чтение и запись можно распараллелить.
+    return {'version': __version__, 'parallel_read_safe': True, 'parallel_write_safe': True}
 
 
-def make_indexes(docs_directory: Path, cfg: Config) -> None:
+def make_indexes(
+    docs_directory: Path,
+    cfg: Config,
+    cache_dir: Optional[Path] = None,
+    write: bool = True,
+    stats: Optional['IndexStats'] = None,
+    watcher: Optional['TreeWatcher'] = None,
+) -> Dict[Path, str]:
     """
     :param docs_directory: Путь к папке с документацией.
     :param cfg: Конфигурация Sphinx.
+    :param cache_dir: Папка для снимка дерева документации между сборками. Если не указана,
+        дерево каждый раз обходится и формируется заново.
+    :param write: Записывать ли сервисные файлы в папку с документацией.
+    :param stats: Сюда записываются время этапов и счётчики.
+    :param watcher: Отслеживание изменений, хранящее дерево документации между сборками
+        в памяти. Если указано, просматриваются только изменившиеся папки и заново
+        формируются только затронутые изменениями сервисные файлы.
+    :return: Сформированные сервисные файлы (путь: содержимое). Пустой словарь, если
+        записанные ранее файлы не требуют изменений. Если отпечаток дерева по индексу git
+        не изменился, возвращаются сервисные файлы из снимка.
     """
-    main_page = MAIN_PAGE
+    from sphinx_autotoc._stats import IndexStats
+
     index = docs_directory / SPHINX_INDEX_FILE_NAME
-    get_headers_from_subfolder = cfg['sphinx_autotoc_get_headers_from_subfolder']
-    header_text = cfg['sphinx_autotoc_header']
-    trim_folder_numbers = cfg['sphinx_autotoc_trim_folder_numbers']
-    src_path = docs_directory / 'src'
-    _check_folder_existence(src_path)
+    roots = _doc_roots(cfg)
+    workers = cfg['sphinx_autotoc_workers']
+    shard_mode = cfg['sphinx_autotoc_shard_mode']
+    _check_choice('sphinx_autotoc_shard_mode', shard_mode, SHARD_MODES)
+    readme_mode = cfg['sphinx_autotoc_readme_mode']
+    _check_choice('sphinx_autotoc_readme_mode', readme_mode, README_MODES)
+    toc_options = _toc_options(cfg)
+    stats = IndexStats() if stats is None else stats
+    for root in roots:
+        _check_folder_existence(docs_directory / root.path)
     autosummary_flag = _check_autosummary_flag(cfg)
-    autosummary_dict: Dict[Path, Tuple[str, str]] = {}
+    autosummary_pattern = cfg['sphinx_autotoc_autosummary_pattern']
+
+    config_key = _config_key(cfg)
+    previous, resident = _previous_snapshot(config_key, cache_dir, watcher)
+    cached = bool(cache_dir) or resident
+    fingerprint = ''
+    # При отслеживании изменений дерево обходится, чтобы сохранить его в памяти
+    if cfg['sphinx_autotoc_git_index'] and cache_dir and watcher is None:
+        with stats.phase('walk'):
+            fingerprint = _git_fingerprint(
+                docs_directory,
+                roots,
+                cfg['source_suffix'],
+                readme_mode == 'inline',
+                autosummary_flag,
+                autosummary_pattern,
+            )
+        if fingerprint and fingerprint == previous.fingerprint:
+            return _restore_pages(docs_directory, cache_dir, previous, write, stats, workers)
+    scan_time = time.time_ns()
+    options = BuildOptions(
+        docs_directory,
+        cfg['exclude_patterns'],
+        cfg['source_suffix'],
+        readme_mode,
+        autosummary_flag,
+        autosummary_pattern,
+        shard_mode,
+        toc_options,
+        workers,
+    )
+    dirty = watcher.changes() if watcher is not None and resident else None
+    reusable = watcher.pages if watcher is not None and resident else None
+    skip_unchanged = cached and write and bool(previous.pages)
+    tasks = [
+        _root_task(root, previous, cached, skip_unchanged, dirty, reusable, docs_directory)
+        for root in roots
+    ]
+    processes = cfg['sphinx_autotoc_processes']
+    results = _process_roots(options, tasks, processes, stats)
+    dir_records = {key: record for result in results for key, record in result.dir_records.items()}
+    if watcher is not None:
+        watcher.sync(dir_records)
+
+    skipped = [i for i, result in enumerate(results) if result.pages is None]
+    if len(skipped) == len(results) and _index_unchanged(docs_directory, roots, previous):
+        stats.files_skipped = len(previous.pages)
+        logger.info('make_indexes: tree is unchanged, nothing to do; %s', stats.summary())
+        return {}
+    # Сервисные файлы неизменившихся корней нужны, если изменились другие корни: такие
+    # корни обходятся повторно, содержимое папок при этом берётся из снимка
+    rerun = [tasks[i]._replace(skip_unchanged=False) for i in skipped]
+    for i, result in zip(skipped, _process_roots(options, rerun, processes, stats, False)):
+        results[i] = result
+
+    main_page = MAIN_PAGE + ''.join(result.main_page for result in results)
+    pages = {path: content for result in results for path, content in (result.pages or {}).items()}
+    pages[index] = main_page.format(project=cfg.project, dop='=' * len(cfg.project))
+
+    page_records = _sync_pages(docs_directory, pages, previous.pages, write, stats, workers)
+    logger.info('make_indexes: %s', stats.summary())
+
+    snapshot = Snapshot(
+        config_key,
+        scan_time,
+        dir_records,
+        {key: value for result in results for key, value in result.inputs.items()},
+        {key: value for result in results for key, value in result.readmes.items()},
+        {key: value for result in results for key, value in result.autosummary.items()},
+        page_records,
+        fingerprint,
+        {
+            _relative_key(docs_directory, path): content
+            for path, content in pages.items()
+            if fingerprint
+        },
+    )
+    if cache_dir:
+        save_snapshot(cache_dir, snapshot)
+    if watcher is not None:
+        watcher.snapshot = snapshot
+        watcher.pages = pages
+    return pages
 
-    main_page_dirs: Dict[Path, List[Path]] = {}  # toctree header: toctree links
 
-    if not get_headers_from_subfolder:
-        main_page_dirs = {src_path: []}
+def _toc_options(cfg: Config) -> TocOptions:
+    """
+    :param cfg: Конфигурация Sphinx.
+    :return: Параметры toctree из конфигурации.
+    """
+    return TocOptions(
+        cfg['sphinx_autotoc_maxdepth'],
+        {int(level): depth for level, depth in cfg['sphinx_autotoc_level_maxdepth'].items()},
+        {key.strip('/'): depth for key, depth in cfg['sphinx_autotoc_dir_maxdepth'].items()},
+        cfg['sphinx_autotoc_titlesonly'],
+        cfg['sphinx_autotoc_toctree_budget'],
+        cfg['sphinx_autotoc_shard_size'],
+    )
 
-    for current_dir, current_dir_files in _iter_dirs(docs_directory, cfg):
-        _process_dir_and_files(
-            src_path,
-            current_dir,
-            current_dir_files,
-            autosummary_flag,
-            autosummary_dict,
-            get_headers_from_subfolder,
-            main_page_dirs,
-            trim_folder_numbers,
-        )
 
-    main_page = _add_to_main_page(
-        main_page_dirs, main_page, trim_folder_numbers, get_headers_from_subfolder, header_text
+def _config_key(cfg: Config) -> str:
+    """
+    :param cfg: Конфигурация Sphinx.
+    :return: Значения параметров конфигурации, от которых зависят сформированные файлы.
+        Значения одинаковы при сборке и в команде python -m sphinx_autotoc, которая не
+        загружает расширения: из source_suffix берутся только суффиксы, а из списка
+        расширений - только то, используется ли autosummary.
+    """
+    # Параметры без области пересборки (число потоков, профилирование и т. п.) на
+    # содержимое сервисных файлов не влияют
+    names = ['project', 'exclude_patterns']
+    names += sorted(name for name, _, rebuild, _ in CONFIG_VALUES if rebuild)
+    values = [(name, cfg[name]) for name in names]
+    values.append(('source_suffix', sorted(cfg['source_suffix'])))
+    autosummary = 'sphinx.ext.autosummary' in cfg.extensions and bool(
+        getattr(cfg, 'autosummary_generate', False)
+    )
+    values.append(('autosummary', autosummary))
+    return repr(values)
+
+
+def _previous_snapshot(
+    config_key: str, cache_dir: Optional[Path], watcher: Optional['TreeWatcher']
+) -> Tuple[Snapshot, bool]:
+    """
+    :param config_key: Значения параметров конфигурации текущей сборки.
+    :param cache_dir: Папка, в которой хранится снимок.
+    :param watcher: Отслеживание изменений.
+    :return: Снимок предыдущей сборки и признак того, что он взят из памяти.
+    """
+    snapshot = watcher.snapshot if watcher is not None else None
+    if snapshot is not None and snapshot.config == config_key:
+        return snapshot, True
+    if cache_dir:
+        return load_snapshot(cache_dir, config_key), False
+    return empty_snapshot(config_key), False
+
+
+def _relative_key(docs_directory: Path, path: Path) -> str:
+    return path.relative_to(docs_directory).as_posix()
+
+
+def _collect_inputs(
+    docs_directory: Path,
+    nodes: List[DirNode],
+    autosummary_flag: bool,
+    readme_flag: bool = True,
+    autosummary_pattern: str = AUTOSUMMARY_FILE_NAME,
+) -> Dict[str, FileSignature]:
+    """
+    Составляет сигнатуры файлов, содержимое которых попадает в сервисные файлы.
+
+    :param docs_directory: Папка с документацией.
+    :param nodes: Папки дерева документации.
+    :param autosummary_flag: Используется ли autosummary.
+    :param readme_flag: Копируется ли содержимое файлов README в сервисные файлы.
+    :param autosummary_pattern: Шаблон имён файлов с директивой autosummary.
+    :return: Сигнатуры файлов README и файлов с директивой autosummary.
+    """
+    inputs: Dict[str, FileSignature] = {}
+    for node in nodes:
+        paths = [node.path / 'README.md'] if readme_flag and node.has_readme else []
+        if autosummary_flag:
+            paths.extend(
+                node.path / file
+                for file in node.files
+                if _is_autosummary_file(file, autosummary_pattern)
+            )
+        for path in paths:
+            signature = file_signature(path)
+            if signature is not None:
+                inputs[_relative_key(docs_directory, path)] = signature
+    return inputs
+
+
+def _collect_readmes(
+    docs_directory: Path,
+    nodes: List[DirNode],
+    readme_mode: str,
+    inputs: Dict[str, FileSignature],
+    previous: Snapshot,
+) -> Dict[Path, str]:
+    """
+    :param docs_directory: Папка с документацией.
+    :param nodes: Папки дерева документации.
+    :param readme_mode: Значение параметра sphinx_autotoc_readme_mode.
+    :param inputs: Сигнатуры файлов текущей сборки.
+    :param previous: Снимок предыдущей сборки.
+    :return: Словарь путь к папке: содержимое README или директива include.
+    """
+    if readme_mode == 'include':
+        return _readme_includes(docs_directory, nodes)
+    return _read_readmes(docs_directory, nodes, inputs, previous)
+
+
+def _read_readmes(
+    docs_directory: Path, nodes: List[DirNode], inputs: Dict[str, FileSignature], previous: Snapshot
+) -> Dict[Path, str]:
+    """
+    Читает файлы README. Файлы, не изменившиеся с предыдущей сборки, берутся из снимка.
+
+    :param docs_directory: Папка с документацией.
+    :param nodes: Папки дерева документации.
+    :param inputs: Сигнатуры файлов текущей сборки.
+    :param previous: Снимок предыдущей сборки.
+    :return: Словарь путь к папке: содержимое README.
+    """
+    readmes: Dict[Path, str] = {}
+    for node in nodes:
+        if not node.has_readme:
+            continue
+        key = _relative_key(docs_directory, node.path / 'README.md')
+        if key not in inputs:
+            continue
+        if key in previous.readmes and previous.inputs.get(key) == inputs[key]:
+            readmes[node.path] = previous.readmes[key]
+        else:
+            with open(node.path / 'README.md', encoding='utf8') as f:
+                readmes[node.path] = f.read()
+    return readmes
+
+
+def _readme_includes(docs_directory: Path, nodes: List[DirNode]) -> Dict[Path, str]:
+    """
+    Составляет директивы include для файлов README.
+
+    Сервисный файл папки при изменении README не меняется: Sphinx сам отслеживает включённые
+    файлы и перечитывает страницу папки.
+
+    :param docs_directory: Папка с документацией.
+    :param nodes: Папки дерева документации.
+    :return: Словарь путь к папке: директива include.
+    """
+    return {
+        node.path: f'\n.. include:: /{_relative_key(docs_directory, node.path / "README.md")}'
+        for node in nodes
+        if node.has_readme
+    }
+
+
+def _reusable_pages(
+    docs_directory: Path,
+    pages: Dict[Path, str],
+    previous: Snapshot,
+    dir_records: Dict[str, DirRecord],
+    inputs: Dict[str, FileSignature],
+) -> Dict[Path, str]:
+    """
+    Отбирает сервисные файлы предыдущей сборки, на которые не повлияли изменения дерева.
+
+    Изменение папки (или файлов README и autosummary в ней) затрагивает её сервисный файл и
+    сервисные файлы всех родительских папок: папка могла стать пустой или перестать быть
+    пустой и пропасть из содержания родителя или появиться в нём.
+
+    :param docs_directory: Папка с документацией.
+    :param pages: Сервисные файлы предыдущей сборки.
+    :param previous: Снимок предыдущей сборки.
+    :param dir_records: Содержимое папок текущей сборки.
+    :param inputs: Сигнатуры файлов README и autosummary текущей сборки.
+    :return: Словарь путь к сервисному файлу: содержимое.
+    """
+    # Время изменения папки меняется и при записи её сервисного файла, поэтому сравнивается
+    # только содержимое папок
+    previous_contents = {key: record[1:] for key, record in previous.dirs.items()}
+    changed = {
+        key for key, record in dir_records.items() if previous_contents.get(key) != record[1:]
+    }
+    changed.update(previous.dirs.keys() - dir_records.keys())
+    changed.update(
+        posixpath.dirname(key)
+        for key in inputs.keys() | previous.inputs.keys()
+        if inputs.get(key) != previous.inputs.get(key)
+    )
+    affected: Set[Path] = set()
+    for key in changed:
+        path = docs_directory / key
+        affected.add(path)
+        affected.update(path.parents)
+    return {path: content for path, content in pages.items() if path.parent not in affected}
+
+
+def _pages_unchanged(docs_directory: Path, previous: Snapshot) -> bool:
+    """
+    :param docs_directory: Папка с документацией.
+    :param previous: Снимок предыдущей сборки.
+    :return: True, если все записанные в предыдущей сборке сервисные файлы не менялись.
+    """
+    return bool(previous.pages) and all(
+        file_signature(docs_directory / key) == signature
+        for key, (_, signature) in previous.pages.items()
+    )
+
+
+def _pregenerated_unchanged(docs_directory: Path, cfg: Config, stats: 'IndexStats') -> bool:
+    """
+    Проверяет сервисные файлы, сформированные командой python -m sphinx_autotoc. Папка src
+    не обходится: предполагается, что команда запускается после каждого изменения дерева.
+
+    :param docs_directory: Папка с документацией.
+    :param cfg: Конфигурация Sphinx.
+    :param stats: Сюда записывается число проверенных файлов.
+    :return: True, если файлы сформированы с той же конфигурацией, что и у сборки, и все
+        записанные командой файлы на месте и не менялись.
+    """
+    snapshot = load_snapshot(
+        docs_directory / PREGENERATED_CACHE_DIR, _config_key(cfg), keep_pages=False
     )
+    with stats.phase('walk'):
+        unchanged = _pages_unchanged(docs_directory, snapshot)
+    if unchanged:
+        stats.files_skipped = len(snapshot.pages)
+    return unchanged
+
+
+def _main_page_dirs(root: DocRoot, tree: DirNode) -> Dict[Path, DirNode]:
+    """
+    :param root: Папка с исходными файлами документации.
+    :param tree: Дерево этой папки.
+    :return: Папки, содержания которых выводятся на индексной странице (заголовок
+        содержания - папка).
+    """
+    if root.get_headers_from_subfolder:
+        return {child.path: child for child in tree.dirs}
+    return {tree.path: tree}
+
+
+def _git_fingerprint(
+    docs_directory: Path,
+    roots: List[DocRoot],
+    source_suffixes: Union[List[str], Dict[str, str]],
+    readme_flag: bool,
+    autosummary_flag: bool,
+    autosummary_pattern: str,
+) -> str:
+    """
+    Составляет отпечаток дерева документации по списку файлов из индекса git.
+
+    В отпечаток входят пути к исходным файлам документации и файлам README, а также
+    содержимое файлов, попадающее в сервисные файлы (README и файлы с директивой
+    autosummary). Шаблоны exclude_patterns не применяются: изменение исключённого файла
+    лишь приводит к обходу дерева.
+
+    :param docs_directory: Папка с документацией.
+    :param roots: Папки с исходными файлами документации.
+    :param source_suffixes: Суффиксы исходных файлов документации.
+    :param readme_flag: Копируется ли содержимое файлов README в сервисные файлы.
+    :param autosummary_flag: Используется ли autosummary.
+    :param autosummary_pattern: Шаблон имён файлов с директивой autosummary.
+    :return: Отпечаток или пустая строка, если список файлов получить не удалось.
+    """
+    files = git_files(docs_directory, [root.path for root in roots])
+    if files is None:
+        return ''
+    digest = hashlib.sha1()
+    for file in files:
+        directory, name = posixpath.split(file)
+        stem, suffix = os.path.splitext(name)
+        if name != 'README.md' and (
+            suffix not in source_suffixes or is_generated_stem(stem, posixpath.basename(directory))
+        ):
+            continue
+        digest.update(f'{file}\0'.encode('utf8', 'surrogateescape'))
+        if (name == 'README.md' and readme_flag) or (
+            autosummary_flag and _is_autosummary_file(name, autosummary_pattern)
+        ):
+            try:
+                with open(docs_directory / file, 'rb') as f:
+                    digest.update(hashlib.sha1(f.read()).digest())
+            except FileNotFoundError:
+                return ''
+    return digest.hexdigest()
+
+
+def _restore_pages(
+    docs_directory: Path,
+    cache_dir: Path,
+    previous: Snapshot,
+    write: bool,
+    stats: 'IndexStats',
+    workers: int,
+) -> Dict[Path, str]:
+    """
+    Берёт сервисные файлы из снимка, не обходя дерево документации: отпечаток дерева по
+    индексу git не изменился. Отсутствующие и изменённые файлы (например, в только что
+    созданной рабочей копии) записываются заново.
+
+    :param docs_directory: Папка с документацией.
+    :param cache_dir: Папка, в которой хранится снимок.
+    :param previous: Снимок предыдущей сборки.
+    :param write: Записывать ли сервисные файлы в папку с документацией.
+    :param stats: Сюда записываются время этапов и счётчики.
+    :param workers: Число потоков для записи.
+    :return: Сервисные файлы (путь: содержимое).
+    """
+    pages = {docs_directory / key: content for key, content in previous.contents.items()}
+    page_records = _sync_pages(docs_directory, pages, previous.pages, write, stats, workers)
+    logger.info('make_indexes: git index is unchanged, pages restored; %s', stats.summary())
+    save_snapshot(cache_dir, previous._replace(pages=page_records))
+    return pages
+
 
-    with open(index, 'w', encoding='utf8') as f:
-        f.write(main_page.format(project=cfg.project, dop='=' * len(cfg.project)))
+def _sync_pages(
+    docs_directory: Path,
+    pages: Dict[Path, str],
+    previous_pages: Dict[str, Tuple[str, FileSignature]],
+    write: bool,
+    stats: 'IndexStats',
+    workers: int,
+) -> Dict[str, Tuple[str, FileSignature]]:
+    """
+    Записывает сервисные файлы и удаляет устаревшие.
 
-    if autosummary_flag:
-        _replace_autosummary(autosummary_dict, docs_directory, index)
+    :param docs_directory: Папка с документацией.
+    :param pages: Сервисные файлы (путь: содержимое).
+    :param previous_pages: Хэши и сигнатуры файлов, записанных в предыдущих сборках.
+    :param write: Записывать ли сервисные файлы. Если нет, удаляются все записанные ранее
+        файлы.
+    :param stats: Сюда записываются время этапов и счётчики.
+    :param workers: Число потоков для записи.
+    :return: Хэши и сигнатуры записанных файлов.
+    """
+    page_records: Dict[str, Tuple[str, FileSignature]] = {}
+    if write:
+        with stats.phase('writing'):
+            stats.files_written, stats.files_skipped, stats.bytes_written = _write_pages(
+                docs_directory, pages, previous_pages, page_records, workers
+            )
+    with stats.phase('cleanup'):
+        produced = {_relative_key(docs_directory, path) for path in pages} if write else set()
+        stats.files_removed += _remove_stale_pages(
+            docs_directory, previous_pages.keys() - produced, previous_pages
+        )
+    return page_records
 
 
 def _check_autosummary_flag(cfg: Config) -> bool:
@@ -100,49 +759,400 @@ def _check_autosummary_flag(cfg: Config) -> bool:
     return False
 
 
-def _process_dir_and_files(
-    src_path: Path,
-    current_dir: Path,
-    current_dir_files: List[Path],
-    autosummary_flag: bool,
-    autosummary_dict: Dict[Path, Tuple[str, str]],
-    get_headers_from_subfolder: bool,
-    main_page_dirs: Dict[Path, List[Path]],
+def _render_dir(
+    docs_directory: Path,
+    root_path: Path,
     trim_folder_numbers: bool,
-) -> None:
-    if autosummary_flag:
-        for file in current_dir_files:
-            if file.name == 'autotoc.autosummary.rst':
-                autosummary_info = _parse_autosummary(current_dir / file)
-                if autosummary_info:
-                    autosummary_dict[current_dir / file] = autosummary_info
-
-    if current_dir.name == '_autosummary':
-        return
-
-    if current_dir != src_path:
-        _add_to_nav(current_dir, current_dir_files, trim_folder_numbers)
-
-    _update_main_page_dirs(
-        main_page_dirs, get_headers_from_subfolder, current_dir, src_path, current_dir_files
+    readmes: Dict[Path, str],
+    autosummary_dict: Dict[Path, Tuple[str, str]],
+    search_paths: Dict[Path, List[str]],
+    shard_mode: str,
+    toc_options: TocOptions,
+    node: DirNode,
+) -> Tuple[Path, Dict[Path, str]]:
+    """
+    Формирует сервисные файлы папки.
+
+    :return: Путь к папке и её сервисные файлы (путь: содержимое). Для корня (папки src)
+        сервисных файлов нет, его содержание находится на индексной странице.
+    """
+    if node.path == root_path:
+        return node.path, {}
+    pages = _add_to_nav(
+        node,
+        trim_folder_numbers,
+        readmes.get(node.path, ''),
+        autosummary_dict,
+        search_paths[node.path],
+        toc_options.shard_size,
+        shard_mode,
+        _toctree_options(
+            docs_directory, node, toc_options, len(node.path.relative_to(root_path).parts)
+        ),
     )
+    return node.path, pages
 
 
-def _update_main_page_dirs(
-    main_page_dirs: Dict[Path, List[Path]],
-    get_headers_from_subfolder: bool,
-    current_dir: Path,
-    src_path: Path,
-    current_dir_files: List[Path],
-) -> None:
-    if get_headers_from_subfolder:
-        if current_dir.parent == src_path:
-            main_page_dirs.update({current_dir: current_dir_files})
+def _in_root(key: str, root: str) -> bool:
+    """
+    :param key: Путь относительно папки с документацией в формате posix.
+    :param root: Путь к корню в том же формате.
+    :return: True, если путь находится в корне.
+    """
+    return key == root or key.startswith(f'{root}/')
+
+
+def _root_task(
+    root: DocRoot,
+    previous: Snapshot,
+    cached: bool,
+    skip_unchanged: bool,
+    dirty: Optional[Set[str]],
+    pages: Optional[Dict[Path, str]],
+    docs_directory: Path,
+) -> RootTask:
+    """
+    Отбирает сведения предыдущей сборки, относящиеся к корню: при обходе в пуле процессов
+    в процесс передаются только они.
+
+    :param root: Корень.
+    :param previous: Снимок предыдущей сборки.
+    :param cached: Использовать ли снимок при обходе.
+    :param skip_unchanged: Не формировать сервисные файлы неизменившегося корня.
+    :param dirty: Изменившиеся папки по данным отслеживания.
+    :param pages: Сервисные файлы предыдущей сборки, хранящиеся в памяти.
+    :param docs_directory: Папка с документацией.
+    """
+    return RootTask(
+        root,
+        previous._replace(
+            dirs={key: record for key, record in previous.dirs.items() if _in_root(key, root.path)},
+            inputs={key: sign for key, sign in previous.inputs.items() if _in_root(key, root.path)},
+            readmes={
+                key: text for key, text in previous.readmes.items() if _in_root(key, root.path)
+            },
+            autosummary={
+                key: info for key, info in previous.autosummary.items() if _in_root(key, root.path)
+            },
+            contents={},
+        ),
+        cached,
+        skip_unchanged,
+        dirty,
+        None
+        if pages is None
+        else {
+            path: content
+            for path, content in pages.items()
+            if _in_root(_relative_key(docs_directory, path.parent), root.path)
+        },
+    )
+
+
+def _process_roots(
+    options: BuildOptions,
+    tasks: List[RootTask],
+    processes: int,
+    stats: 'IndexStats',
+    counters: bool = True,
+) -> List[RootResult]:
+    """
+    Обходит корни и формирует их сервисные файлы. Корни не зависят друг от друга: при
+    processes > 1 каждый корень обходится и формируется в отдельном процессе, иначе корни
+    обрабатываются по очереди, а папки формируются в пуле из workers потоков.
+
+    :param options: Параметры формирования.
+    :param tasks: Корни.
+    :param processes: Число процессов.
+    :param stats: Сюда добавляются время этапов и счётчики корней. Время работы пула
+        процессов записывается одним этапом roots.
+    :param counters: Добавлять ли счётчики.
+    :return: Результаты в порядке корней.
+    """
+    if processes > 1 and len(tasks) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        process = partial(_process_root, options._replace(workers=1))
+        with stats.phase('roots'), ProcessPoolExecutor(min(processes, len(tasks))) as executor:
+            results = list(executor.map(process, tasks))
     else:
-        if current_dir == src_path:
-            main_page_dirs[src_path].extend(current_dir_files)
-        elif current_dir.parent == src_path:
-            main_page_dirs[src_path].append(Path(current_dir.name))
+        results = [_process_root(options, task) for task in tasks]
+    for result in results:
+        stats.merge(result.stats, timings=processes <= 1 or len(tasks) <= 1, counters=counters)
+    return results
+
+
+def _process_root(options: BuildOptions, task: RootTask) -> RootResult:
+    """
+    Обходит корень и формирует сервисные файлы его папок.
+
+    :param options: Параметры формирования.
+    :param task: Корень.
+    :return: Содержимое папок, сигнатуры файлов, сервисные файлы и содержания корня на
+        индексной странице.
+    """
+    from sphinx_autotoc._stats import IndexStats
+
+    docs_directory, root, previous = options.docs_directory, task.root, task.previous
+    stats = IndexStats()
+    dir_records: Dict[str, DirRecord] = {}
+    with stats.phase('walk'):
+        tree = _scan_tree(
+            docs_directory,
+            options.exclude_patterns,
+            options.source_suffixes,
+            previous.dirs if task.cached else None,
+            previous.scan_time - MTIME_GRANULARITY_NS,
+            dir_records,
+            task.dirty,
+            root.path,
+        )
+        stats.files_removed = _remove_moved_pages(tree, previous.pages)
+        nodes = list(_iter_dirs(tree))
+        # Включённые через include файлы README Sphinx отслеживает сам
+        inputs = _collect_inputs(
+            docs_directory,
+            nodes,
+            options.autosummary_flag,
+            options.readme_mode == 'inline',
+            options.autosummary_pattern,
+        )
+    stats.directories = len(nodes)
+    stats.files = sum(len(node.files) for node in nodes)
+    if task.skip_unchanged and _root_unchanged(docs_directory, root, previous, dir_records, inputs):
+        return RootResult(dir_records, inputs, None, '', {}, {}, stats)
+
+    with stats.phase('readme'):
+        readmes = _collect_readmes(docs_directory, nodes, options.readme_mode, inputs, previous)
+    with stats.phase('autosummary'):
+        autosummary_dict = (
+            _collect_autosummary(
+                docs_directory, nodes, options.autosummary_pattern, inputs, previous
+            )
+            if options.autosummary_flag
+            else {}
+        )
+    reused: Dict[Path, str] = {}
+    if task.reusable_pages is not None:
+        reused = _reusable_pages(docs_directory, task.reusable_pages, previous, dir_records, inputs)
+    pages, main_page = _render_root(
+        options, root, tree, nodes, readmes, autosummary_dict, reused, stats
+    )
+    return RootResult(
+        dir_records,
+        inputs,
+        pages,
+        main_page,
+        {
+            _relative_key(docs_directory, path / 'README.md'): text
+            for path, text in readmes.items()
+            if options.readme_mode == 'inline'
+        },
+        {_relative_key(docs_directory, path): info for path, info in autosummary_dict.items()},
+        stats,
+    )
+
+
+def _render_root(
+    options: BuildOptions,
+    root: DocRoot,
+    tree: DirNode,
+    nodes: List[DirNode],
+    readmes: Dict[Path, str],
+    autosummary_dict: Dict[Path, Tuple[str, str]],
+    reused: Dict[Path, str],
+    stats: 'IndexStats',
+) -> Tuple[Dict[Path, str], str]:
+    """
+    Формирует сервисные файлы папок корня и его содержания на индексной странице.
+
+    :param options: Параметры формирования.
+    :param root: Корень.
+    :param tree: Дерево корня.
+    :param nodes: Папки корня в порядке обхода.
+    :param readmes: Содержимое файлов README или директивы include.
+    :param autosummary_dict: Сведения о файлах с директивой autosummary.
+    :param reused: Сервисные файлы предыдущей сборки, которые не формируются заново.
+    :param stats: Сюда записывается время этапов.
+    :return: Сервисные файлы папок в порядке обхода и содержания корня.
+    """
+    docs_directory = options.docs_directory
+    with stats.phase('grouping'):
+        main_page_dirs = _main_page_dirs(root, tree)
+    reused_dirs = {path.parent for path in reused}
+    nodes_to_render = [node for node in nodes if node.path not in reused_dirs]
+    with stats.phase('sorting'):
+        search_paths = {
+            node.path: _make_search_paths(node)
+            for node in itertools.chain(nodes_to_render, main_page_dirs.values())
+        }
+
+    with stats.phase('rendering'):
+        render = partial(
+            _render_dir,
+            docs_directory,
+            docs_directory / root.path,
+            root.trim_folder_numbers,
+            readmes,
+            autosummary_dict,
+            search_paths,
+            options.shard_mode,
+            options.toc_options,
+        )
+        rendered = dict(_map(render, nodes_to_render, options.workers))
+        main_page = _add_to_main_page(
+            docs_directory,
+            main_page_dirs,
+            '',
+            root.trim_folder_numbers,
+            root.get_headers_from_subfolder,
+            root.caption,
+            autosummary_dict,
+            search_paths,
+            options.toc_options,
+        )
+    return _merge_pages(nodes, rendered, reused), main_page
+
+
+def _root_unchanged(
+    docs_directory: Path,
+    root: DocRoot,
+    previous: Snapshot,
+    dir_records: Dict[str, DirRecord],
+    inputs: Dict[str, FileSignature],
+) -> bool:
+    """
+    :param docs_directory: Папка с документацией.
+    :param root: Корень.
+    :param previous: Снимок предыдущей сборки, относящийся к корню.
+    :param dir_records: Содержимое папок корня.
+    :param inputs: Сигнатуры файлов README и autosummary корня.
+    :return: True, если папки и файлы корня не изменились с предыдущей сборки, а его
+        записанные сервисные файлы не менялись.
+    """
+    return (
+        dir_records == previous.dirs
+        and inputs == previous.inputs
+        and all(
+            file_signature(docs_directory / key) == signature
+            for key, (_, signature) in previous.pages.items()
+            if _in_root(key, root.path)
+        )
+    )
+
+
+def _index_unchanged(docs_directory: Path, roots: List[DocRoot], previous: Snapshot) -> bool:
+    """
+    :param docs_directory: Папка с документацией.
+    :param roots: Корни.
+    :param previous: Снимок предыдущей сборки.
+    :return: True, если не менялись записанные в предыдущей сборке сервисные файлы вне
+        корней (индексная страница).
+    """
+    return all(
+        file_signature(docs_directory / key) == signature
+        for key, (_, signature) in previous.pages.items()
+        if not any(_in_root(key, root.path) for root in roots)
+    )
+
+
+def _merge_pages(
+    nodes: List[DirNode], rendered: Dict[Path, Dict[Path, str]], reused: Dict[Path, str]
+) -> Dict[Path, str]:
+    """
+    :param nodes: Папки в порядке обхода.
+    :param rendered: Сформированные сервисные файлы папок (путь к папке: сервисные файлы).
+    :param reused: Сервисные файлы предыдущей сборки, которые не формировались заново.
+    :return: Сервисные файлы папок в порядке обхода.
+    """
+    dir_pages: Dict[Path, Dict[Path, str]] = {}
+    for path, content in reused.items():
+        dir_pages.setdefault(path.parent, {})[path] = content
+    dir_pages.update(rendered)
+    pages: Dict[Path, str] = {}
+    for node in nodes:
+        pages.update(dir_pages.get(node.path, {}))
+    return pages
+
+
+def _map(func: Callable[[T], R], items: Iterable[T], workers: int) -> List[R]:
+    """
+    Применяет функцию к элементам, при workers > 1 - в пуле потоков.
+
+    Результаты возвращаются в порядке элементов, поэтому не зависят от числа потоков.
+
+    :param func: Функция.
+    :param items: Элементы.
+    :param workers: Число потоков.
+    :return: Результаты функции.
+    """
+    if workers <= 1:
+        return [func(item) for item in items]
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, items))
+
+
+def _is_autosummary_file(name: str, pattern: str = AUTOSUMMARY_FILE_NAME) -> bool:
+    """
+    :param name: Имя файла.
+    :param pattern: Шаблон имён файлов с директивой autosummary.
+    """
+    return fnmatch.fnmatchcase(name, pattern)
+
+
+def _doc_roots(cfg: Config) -> List[DocRoot]:
+    """
+    :param cfg: Конфигурация Sphinx.
+    :return: Корни из sphinx_autotoc_roots в заданном порядке. Если параметр не задан -
+        единственный корень src.
+    """
+    default = DocRoot(
+        'src',
+        cfg['sphinx_autotoc_header'],
+        cfg['sphinx_autotoc_trim_folder_numbers'],
+        cfg['sphinx_autotoc_get_headers_from_subfolder'],
+    )
+    roots: List[DocRoot] = []
+    for item in cfg['sphinx_autotoc_roots'] or [default.path]:
+        options = {'path': item} if isinstance(item, str) else dict(item)
+        unknown = options.keys() - set(DocRoot._fields)
+        if unknown or 'path' not in options:
+            errormsg = (
+                f'Недопустимый элемент sphinx_autotoc_roots: {item!r}. Элемент - путь к папке '
+                f'или словарь с ключами {", ".join(map(repr, DocRoot._fields))} (path обязателен).'
+            )
+            raise ExtensionError(errormsg)
+        path = PurePosixPath(options['path'])
+        # Корень, содержащий папку с документацией, содержал бы и индексную страницу
+        if path.is_absolute() or not path.parts or '..' in path.parts:
+            errormsg = (
+                f'Недопустимый путь в sphinx_autotoc_roots: {path}. Корень - вложенная папка '
+                'папки с документацией.'
+            )
+            raise ExtensionError(errormsg)
+        options['path'] = path.as_posix()
+        roots.append(default._replace(**options))
+    _check_roots_overlap(roots)
+    return roots
+
+
+def _check_roots_overlap(roots: List[DocRoot]) -> None:
+    paths = sorted(PurePosixPath(root.path) for root in roots)
+    for parent, child in zip(paths, paths[1:]):
+        if parent == child or parent in child.parents:
+            errormsg = f'Корни sphinx_autotoc_roots пересекаются: {parent} и {child}.'
+            raise ExtensionError(errormsg)
+
+
+def _check_choice(name: str, value: str, choices: Tuple[str, ...]) -> None:
+    if value not in choices:
+        errormsg = (
+            f'Недопустимое значение {name}: {value!r}. '
+            f'Допустимые значения: {", ".join(map(repr, choices))}.'
+        )
+        raise ExtensionError(errormsg)
 
 
 def _check_folder_existence(folder: Path) -> None:
@@ -151,133 +1161,511 @@ def _check_folder_existence(folder: Path) -> None:
         raise ExtensionError(errormsg)
 
 
-def _replace_autosummary(
-    autosummary_dict: Dict[Path, Tuple[str, str]], docs_directory: Path, index: Path
-) -> None:
+def _collect_autosummary(
+    docs_directory: Path,
+    nodes: List[DirNode],
+    pattern: str,
+    inputs: Dict[str, FileSignature],
+    previous: Snapshot,
+) -> Dict[Path, Tuple[str, str]]:
     """
-    Меняет заголовок ссылки на autosummary на заголовок файла с директивой autosummary.
+    Собирает сведения о файлах с директивой autosummary. Файлы, не изменившиеся с предыдущей
+    сборки, не читаются: сведения о них берутся из снимка.
 
-    :param autosummary_dict: Словарь с путями к файлам с директивой autosummary.
-    :param docs_directory: Путь к папке с документацией.
-    :param index: Путь к индексной странице.
+    :param docs_directory: Папка с документацией.
+    :param nodes: Папки дерева документации.
+    :param pattern: Шаблон имён файлов с директивой autosummary.
+    :param inputs: Сигнатуры файлов текущей сборки.
+    :param previous: Снимок предыдущей сборки.
+    :return: Словарь путь к файлу с директивой autosummary: заголовок файла и имя модуля.
     """
-    for file_path, (file_header, module_name) in autosummary_dict.items():
-        if any((file_header, module_name, file_path)) is None:
-            continue
-        logger.debug('module name: %s, file path:%s', module_name, file_path)
-        logger.info('Working on autosummary reference...')
-        autosummary_index = _get_dir_index(file_path.parent)
-        if autosummary_index.parent == docs_directory:
-            autosummary_index = index
-        elif autosummary_index.parent.parent == docs_directory / 'src':
-            _replace_autosummary_with_api_reference(index, file_path, module_name, file_header)
-        _replace_autosummary_with_api_reference(
-            autosummary_index, file_path, module_name, file_header
-        )
-
-
-def _replace_autosummary_with_api_reference(
-    index: Path, file_path: Path, module_name: str, autosummary_header: str
-) -> None:
+    autosummary_dict: Dict[Path, Tuple[str, str]] = {}
+    for node in nodes:
+        for file in node.files:
+            if not _is_autosummary_file(file, pattern):
+                continue
+            path = node.path / file
+            key = _relative_key(docs_directory, path)
+            if key in inputs and previous.inputs.get(key) == inputs[key]:
+                autosummary_info = previous.autosummary.get(key)
+            else:
+                autosummary_info = _parse_autosummary(path)
+            if autosummary_info:
+                logger.debug('module name: %s, file path:%s', autosummary_info[1], file)
+                autosummary_dict[path] = autosummary_info
+    return autosummary_dict
+
+
+def _make_toctree_entries(
+    node: DirNode,
+    search_paths: List[str],
+    prefix: str,
+    autosummary_dict: Dict[Path, Tuple[str, str]],
+) -> List[str]:
     """
-    Заменяет ссылку на autosummary в индексной странице на ссылку на API reference.
+    Формирует строки toctree для содержимого папки.
 
-    :param index: Путь к индексной странице.
-    :param file_path: Путь к файлу с autosummary.
-    :param module_name: Имя модуля autosummary.
-    :param autosummary_header: Заголовок для autosummary.
+    Ссылка на файл с директивой autosummary заменяется ссылкой на API reference с заголовком
+    этого файла.
+
+    :param node: Папка в дереве документации.
+    :param search_paths: Пути к содержимому папки.
+    :param prefix: Путь к папке относительно страницы, на которой находится toctree.
+    :param autosummary_dict: Сведения о файлах с директивой autosummary.
+    :return: Строки toctree.
     """
-    with open(index, 'r+', encoding='utf8') as f:
-        f.seek(0)
-        lines = f.readlines()
-        for i, line in enumerate(lines):
-            if file_path.name in line:
-                lines[i] = (
-                    f"   {autosummary_header} <"
-                    f"{Path(line.strip()).parent / '_autosummary' / module_name}>\n"
-                )
-        f.seek(0)
-        f.writelines(lines)
-        f.truncate()
+    entries = []
+    for item in search_paths:
+        entry = f'{prefix}{item}'
+        autosummary_info = autosummary_dict.get(node.path / item)
+        if autosummary_info:
+            autosummary_header, module_name = autosummary_info
+            entry = f"{autosummary_header} <{Path(entry).parent / '_autosummary' / module_name}>"
+        entries.append(entry)
+    return entries
 
 
 def _parse_autosummary(file: Path) -> Union[Tuple[str, str], None]:
     """
-    Парсит файл с директивой autosummary.
+    Парсит файл с директивой autosummary. Файл читается построчно и только до первого
+    элемента директивы.
 
     :param file: Путь к файлу с директивой
-    :return: Заголовок файла и имя модуля.
+    :return: Заголовок файла и имя модуля или None, если директивы или элементов в ней нет.
     """
-    with open(file) as f:
-        lines = f.readlines()
-        for i in range(len(lines)):
-            if lines[i].strip() == '.. autosummary::':
+    with open(file, encoding='utf8') as f:
+        header = f.readline()
+        for line in itertools.chain([header], f):
+            if line.strip() == '.. autosummary::':
                 break
-        for j in range(i + 1, len(lines)):
-            next_line = lines[j].strip()
+        else:
+            return None
+        for line in f:
+            next_line = line.strip()
             if len(next_line) > 1 and not next_line.startswith(':'):
-                return lines[0].strip(), next_line
+                return header.strip(), next_line
     return None
 
 
 def _add_to_main_page(
-    dirs: Dict[Path, List[Path]],
+    docs_directory: Path,
+    dirs: Dict[Path, DirNode],
     main_page: str,
     trim_folder_numbers: bool,
     get_headers_from_subfolder: bool,
     header_text: str,
+    autosummary_dict: Dict[Path, Tuple[str, str]],
+    dirs_search_paths: Dict[Path, List[str]],
+    toc_options: Optional[TocOptions] = None,
 ) -> str:
     """
     Добавляет дерево содержания папок в индексную страницу проекта.
 
+    :param docs_directory: Папка с документацией.
     :param dirs: Словарь с содержанием папок
     :param main_page: Содержимое индексной страницы.
     :param trim_folder_numbers: Удалять ли номера папок.
+    :param autosummary_dict: Сведения о файлах с директивой autosummary.
+    :param dirs_search_paths: Отсортированные пути к содержимому папок.
+    :param toc_options: Параметры toctree.
     :return main_page: Изменённое содержимое индексной страницы.
     """
-    for path, docs in dirs.items():
-        search_paths = _make_search_paths(path, docs)
+    toc_options = toc_options or TocOptions()
+    for path, node in dirs.items():
+        search_paths = dirs_search_paths[path]
         dirname = trim_leading_numbers(path.name) if trim_folder_numbers else path.name
-        str_search_paths: List[str] = []
-        if get_headers_from_subfolder:
-            for item in search_paths:
-                str_search_paths.append(f'src/{path.name}/{item}')
-        else:
-            for item in search_paths:
-                str_search_paths.append(f'{path.name}/{item}')
+        prefix = f'{_relative_key(docs_directory, path)}/'
+        str_search_paths = _make_toctree_entries(node, search_paths, prefix, autosummary_dict)
         main_page += TOCTREE.format(
+            options=_toctree_options(docs_directory, node, toc_options, level=0),
             group_name=dirname if get_headers_from_subfolder else header_text,
             group_dirs='\n   '.join(str_search_paths),
         )
     return main_page
 
 
-def _add_to_nav(path: Path, docs: List[Path], trim_folder_numbers: bool) -> None:
+def _add_to_nav(
+    node: DirNode,
+    trim_folder_numbers: bool,
+    readme: str = '',
+    autosummary_dict: Optional[Dict[Path, Tuple[str, str]]] = None,
+    search_paths: Optional[List[str]] = None,
+    shard_size: int = 0,
+    shard_mode: str = 'size',
+    toctree_options: str = ':maxdepth: 2',
+) -> Dict[Path, str]:
     """
-    Добавляет рядом с папкой её сервисный файл.
+    Формирует сервисные файлы папки.
 
     В сервисном файле находится дерево содержания папки (toctree) и, если есть,
-    содержимое файла README из этой папки
+    содержимое файла README из этой папки.
 
-    :param path: Путь до папки.
-    :param docs: Список файлов в папке.
+    Если файлов в папке больше shard_size, ссылки на них разбиваются на части не больше
+    shard_size ссылок, каждая часть выносится в отдельный сервисный файл
+    (autotoc.<папка>.part-01.rst), а в содержании папки остаются вложенные папки и ссылки на
+    части. Так размер каждой страницы содержания и боковой панели остаётся ограниченным.
+
+    :param node: Папка в дереве документации.
     :param trim_folder_numbers: Удалять ли номера папок.
+    :param readme: Содержимое файла README из папки или директива include, включающая его.
+    :param autosummary_dict: Сведения о файлах с директивой autosummary.
+    :param search_paths: Отсортированные пути к содержимому папки, если уже известны.
+    :param shard_size: Наибольшее число ссылок на файлы в одном сервисном файле, 0 - без
+        ограничения.
+    :param shard_mode: Способ разбиения: 'size' - части по shard_size ссылок, 'alpha' - части
+        по первым буквам названий.
+    :param toctree_options: Параметры директивы toctree.
+    :return: Сервисный файл папки и сервисные файлы частей (путь: содержимое).
     """
-    content = ''
-    include_file = path / 'README.md'
-    if include_file.exists():
-        with open(include_file.as_posix(), encoding='utf8') as f:
-            content = f.read()
-
-    index_path = _get_dir_index(path)
+    path = node.path
     dirname = trim_leading_numbers(path.name) if trim_folder_numbers else path.name
-    search_paths = _make_search_paths(path, docs)
-    with open(index_path.as_posix(), 'w', encoding='utf-8') as f:
-        f.write(
-            NAV_PATTERN.format(
-                dirname=dirname, search_paths='\n   '.join(map(str, search_paths)), includes=content
+    if search_paths is None:
+        search_paths = _make_search_paths(node)
+    entries = _make_toctree_entries(node, search_paths, '', autosummary_dict or {})
+
+    shard_pages: Dict[Path, str] = {}
+    # Ссылки на вложенные папки идут первыми и на части не разбиваются
+    folder_entries, file_entries = entries[: len(node.dirs)], entries[len(node.dirs) :]
+    if shard_size and len(file_entries) > shard_size:
+        shards = _split_shards(file_entries, shard_size, shard_mode)
+        width = max(2, len(str(len(shards))))
+        shard_names = []
+        for number, (title, shard) in enumerate(shards, 1):
+            name = f'{shard_page_stem(path.name, number, width)}.rst'
+            shard_pages[path / name] = NAV_PATTERN.format(
+                dirname=title,
+                search_paths='\n   '.join(shard),
+                includes='',
+                options=toctree_options,
             )
-        )
+            shard_names.append(name)
+        entries = folder_entries + shard_names
+
+    content = NAV_PATTERN.format(
+        dirname=dirname,
+        search_paths='\n   '.join(entries),
+        includes=readme,
+        options=toctree_options,
+    )
+    return {_get_dir_index(path): content, **shard_pages}
+
+
+def _toctree_options(
+    docs_directory: Path, node: DirNode, toc_options: TocOptions, level: Optional[int] = None
+) -> str:
+    """
+    Составляет параметры toctree с содержанием папки.
+
+    Глубина берётся из настройки для папки, затем для уровня, затем общей. Если задан
+    бюджет, глубина уменьшается, пока развёрнутый toctree содержит больше ссылок, чем
+    позволяет бюджет (но не меньше 1).
+
+    :param docs_directory: Папка с документацией.
+    :param node: Папка, содержание которой выводит toctree.
+    :param toc_options: Параметры toctree.
+    :param level: Уровень страницы с toctree. По умолчанию - уровень сервисного файла папки.
+    :return: Строки параметров директивы toctree.
+    """
+    relative_path = node.path.relative_to(docs_directory)
+    if level is None:
+        level = len(relative_path.parts) - 1
+    maxdepth = toc_options.dir_maxdepth.get(
+        relative_path.as_posix(), toc_options.level_maxdepth.get(level, toc_options.maxdepth)
+    )
+    if toc_options.budget:
+        depth = maxdepth if maxdepth > 0 else _toc_height(node, toc_options.shard_size)
+        while depth > 1 and _toc_size(node, depth, toc_options) > toc_options.budget:
+            depth -= 1
+            maxdepth = depth
+    options = f':maxdepth: {maxdepth}'
+    if toc_options.titlesonly:
+        options += '\n   :titlesonly:'
+    return options
+
+
+def _file_entries(node: DirNode) -> int:
+    return sum(1 for file in node.files if not _is_generated_file(file, node.path.name))
+
+
+def _toc_size(node: DirNode, depth: int, toc_options: TocOptions) -> int:
+    """
+    Считает ссылки в развёрнутом на depth уровней toctree с содержанием папки. Разделы внутри
+    страниц не учитываются.
+
+    :param node: Папка.
+    :param depth: Глубина toctree.
+    :param toc_options: Параметры toctree.
+    :return: Число ссылок. Подсчёт останавливается, как только превышен бюджет.
+    """
+    files = _file_entries(node)
+    size = files
+    if toc_options.shard_size and files > toc_options.shard_size:
+        # Ссылки на файлы вынесены в части, части видны на уровень глубже
+        size = -(-files // toc_options.shard_size) + (files if depth > 1 else 0)
+    for child in node.dirs:
+        if size > toc_options.budget:
+            break
+        size += 1
+        if depth > 1:
+            size += _toc_size(child, depth - 1, toc_options)
+    return size
+
+
+def _toc_height(node: DirNode, shard_size: int) -> int:
+    """
+    :param node: Папка.
+    :param shard_size: Наибольшее число ссылок на файлы в сервисном файле.
+    :return: Глубина, на которой toctree с содержанием папки разворачивается полностью.
+    """
+    files = _file_entries(node)
+    height = 2 if shard_size and files > shard_size else 1
+    for child in node.dirs:
+        height = max(height, 1 + _toc_height(child, shard_size))
+    return height
+
+
+def _split_shards(entries: List[str], size: int, mode: str) -> List[Tuple[str, List[str]]]:
+    """
+    Разбивает ссылки toctree на части.
+
+    :param entries: Отсортированные ссылки.
+    :param size: Наибольшее число ссылок в части.
+    :param mode: 'size' - части по size ссылок; 'alpha' - ссылки, названия которых
+        начинаются с одной буквы, попадают в одну часть, соседние буквы объединяются, пока
+        часть не превышает size ссылок (слишком большие буквы делятся на части по size).
+        Регистр букв не учитывается: ссылки заново сортируются без учёта регистра, иначе
+        "a…" оказались бы после "B…" в отдельной части.
+    :return: Заголовки частей и ссылки в них.
+    """
+    chunks: List[List[str]] = []
+    if mode == 'alpha':
+        entries = sorted(entries, key=_alpha_key)
+        for _, group in itertools.groupby(entries, key=_first_letter):
+            items = list(group)
+            if chunks and len(chunks[-1]) + len(items) <= size:
+                chunks[-1].extend(items)
+            else:
+                chunks.extend(items[i : i + size] for i in range(0, len(items), size))
+    else:
+        chunks = [entries[i : i + size] for i in range(0, len(entries), size)]
+
+    shards = []
+    for chunk in chunks:
+        if mode == 'alpha':
+            first, last = _first_letter(chunk[0]), _first_letter(chunk[-1])
+        else:
+            first, last = _entry_title(chunk[0]), _entry_title(chunk[-1])
+        shards.append((first if first == last else f'{first} – {last}', chunk))
+    return shards
+
+
+def _entry_title(entry: str) -> str:
+    """
+    :param entry: Ссылка toctree: путь к файлу или "Заголовок <путь>".
+    :return: Название, по которому ссылки группируются в части.
+    """
+    if entry.endswith('>') and ' <' in entry:
+        return entry[: entry.rindex(' <')]
+    return Path(entry).stem
+
+
+def _alpha_key(entry: str) -> Any:
+    """
+    :param entry: Ссылка toctree.
+    :return: Ключ естественной сортировки названия без учёта регистра.
+    """
+    return _natural_keygen()(_entry_title(entry).casefold())
+
+
+def _first_letter(entry: str) -> str:
+    """
+    :param entry: Ссылка toctree.
+    :return: Первая буква названия без учёта регистра (заглавная) - заголовок части.
+    """
+    return _entry_title(entry)[:1].casefold().upper()
+
+
+def _write_pages(
+    docs_directory: Path,
+    pages: Dict[Path, str],
+    previous_pages: Dict[str, Tuple[str, FileSignature]],
+    page_records: Dict[str, Tuple[str, FileSignature]],
+    workers: int = 1,
+) -> Tuple[int, int, int]:
+    """
+    Записывает сервисные файлы на диск.
+
+    Файл, хэш содержимого и сигнатура которого совпадают с записанными в снимке предыдущей
+    сборки, не перечитывается.
+
+    :param docs_directory: Папка с документацией.
+    :param pages: Словарь путь к файлу: содержимое файла.
+    :param previous_pages: Хэши и сигнатуры файлов из снимка предыдущей сборки.
+    :param page_records: Сюда записываются хэши и сигнатуры файлов текущей сборки.
+    :param workers: Число потоков для записи.
+    :return: Количество записанных и пропущенных (не изменившихся) файлов, объём записанных
+        файлов в байтах.
+    """
+    write = partial(_write_page, docs_directory, previous_pages)
+    written = 0
+    bytes_written = 0
+    for key, size, record in _map(write, pages.items(), workers):
+        if size is not None:
+            written += 1
+            bytes_written += size
+        if record is not None:
+            page_records[key] = record
+    return written, len(pages) - written, bytes_written
+
+
+def _write_page(
+    docs_directory: Path,
+    previous_pages: Dict[str, Tuple[str, FileSignature]],
+    page: Tuple[Path, str],
+) -> Tuple[str, Optional[int], Optional[Tuple[str, FileSignature]]]:
+    """
+    Записывает сервисный файл на диск, если он изменился.
+
+    :return: Путь к файлу относительно папки с документацией, объём записанных данных в байтах
+        (None, если файл не записывался), хэш и сигнатура файла.
+    """
+    path, content = page
+    key = _relative_key(docs_directory, path)
+    data = content.encode('utf8')
+    content_hash = hashlib.sha1(data).hexdigest()
+    signature = file_signature(path)
+    size = None
+    if previous_pages.get(key) != (content_hash, signature) and _write_if_changed(path, content):
+        size = len(data)
+        signature = file_signature(path)
+    return key, size, None if signature is None else (content_hash, signature)
+
+
+def _remove_stale_pages(
+    docs_directory: Path, keys: Iterable[str], previous_pages: Dict[str, Tuple[str, FileSignature]]
+) -> int:
+    """
+    Удаляет сервисные файлы, записанные в предыдущих сборках, но больше не формируемые
+    (например, файлы удалённых папок или все файлы при переходе на виртуальные сервисные
+    файлы). Иначе Sphinx продолжает читать их как документы без родителя.
+
+    Файл удаляется, только если его содержимое не менялось после записи.
+
+    :param docs_directory: Папка с документацией.
+    :param keys: Пути к файлам относительно папки с документацией.
+    :param previous_pages: Хэши и сигнатуры файлов, записанных в предыдущих сборках.
+    :return: Число удалённых файлов.
+    """
+    removed = 0
+    for key in sorted(keys):
+        if _remove_if_hash_matches(docs_directory / key, {previous_pages[key][0]}):
+            removed += 1
+    return removed
+
+
+def _remove_moved_pages(tree: DirNode, previous_pages: Dict[str, Tuple[str, FileSignature]]) -> int:
+    """
+    Удаляет сервисные файлы, попавшие в чужую папку: после переименования папки old в new
+    в ней остаётся файл autotoc.old.rst. Удалённые файлы убираются из дерева, чтобы не
+    попасть в содержание.
+
+    :param tree: Корень дерева документации.
+    :param previous_pages: Хэши и сигнатуры файлов, записанных в предыдущих сборках.
+    :return: Число удалённых файлов.
+    """
+    hashes = {content_hash for content_hash, _ in previous_pages.values()}
+    if not hashes:
+        return 0
+    return _remove_moved_from(tree, hashes)
+
+
+def _remove_moved_from(node: DirNode, hashes: Set[str]) -> int:
+    """
+    Удаляет перенесённые сервисные файлы из поддерева. Папки, в которых кроме таких файлов
+    ничего не было, убираются из дерева, как и при обходе.
+
+    :param node: Корень поддерева.
+    :param hashes: Хэши содержимого сервисных файлов.
+    :return: Число удалённых файлов.
+    """
+    removed = sum(_remove_moved_from(child, hashes) for child in node.dirs)
+    if removed:
+        node.dirs = [child for child in node.dirs if child.dirs or child.files]
+    moved = {
+        file
+        for file in node.files
+        if file.endswith('.rst')
+        and file.startswith(f'{SPHINX_SERVICE_FILE_PREFIX}.')
+        and not _is_autosummary_file(file)
+        and not _is_generated_file(file, node.path.name)
+        and _remove_if_hash_matches(node.path / file, hashes)
+    }
+    if moved:
+        node.files = [file for file in node.files if file not in moved]
+    return removed + len(moved)
+
+
+def _remove_if_hash_matches(path: Path, hashes: Set[str]) -> bool:
+    """
+    :param path: Путь к файлу.
+    :param hashes: Хэши содержимого сервисных файлов.
+    :return: True, если хэш содержимого файла есть в hashes и файл удалён.
+    """
+    if _page_hash(path) not in hashes:
+        return False
+    logger.info('make_indexes: removing stale %s', path)
+    os.remove(path)
+    return True
+
+
+def _write_if_changed(path: Path, content: str) -> bool:
+    """
+    Записывает файл, только если его содержимое изменилось.
+
+    Неизменённые файлы не перезаписываются, чтобы не менять время их модификации:
+    по нему Sphinx определяет, какие документы нужно перечитать.
+
+    :param path: Путь к файлу.
+    :param content: Новое содержимое файла.
+    :return: True, если файл был записан.
+    """
+    if not _page_changed(path, content):
+        return False
+    with open(path, 'w', encoding='utf8') as f:
+        f.write(content)
+    return True
+
+
+def _read_page(path: Path) -> Optional[str]:
+    """
+    :param path: Путь к файлу.
+    :return: Содержимое файла, прочитанное так же, как при записи, или None, если файла нет
+        или он не в кодировке utf8.
+    """
+    try:
+        with open(path, encoding='utf8') as f:
+            return f.read()
+    except (FileNotFoundError, UnicodeDecodeError):
+        return None
+
+
+def _page_changed(path: Path, content: str) -> bool:
+    """
+    :param path: Путь к файлу.
+    :param content: Новое содержимое файла.
+    :return: True, если содержимое файла отличается от нового (или файла нет).
+    """
+    return _read_page(path) != content
+
+
+def _page_hash(path: Path) -> Optional[str]:
+    """
+    :param path: Путь к файлу.
+    :return: Хэш содержимого файла в том виде, в каком он записывается в снимок, или None,
+        если файл не прочитать.
+    """
+    content = _read_page(path)
+    return None if content is None else hashlib.sha1(content.encode('utf8')).hexdigest()
 
 
 def trim_leading_numbers(input: str) -> str:
@@ -309,7 +1697,7 @@ def _get_dir_index(path: Path) -> Path:
     return path / f'{SPHINX_SERVICE_FILE_PREFIX}.{path.name}.rst'
 
 
-def _make_search_paths(root: Path, f: List[Path]) -> List[Path]:
+def _make_search_paths(node: DirNode) -> List[str]:
     """
     Создает пути к содержимому в папке.
 
@@ -319,122 +1707,252 @@ def _make_search_paths(root: Path, f: List[Path]) -> List[Path]:
     (root/dir/autotoc.dir.rst)
 
     Итоговый список содержит пути к папкам и файлам, отсортированные по типу: сначала идут
-    папки, отсортированные по алфавиту, затем - файлы, также отсортированные по алфавиту.
+    папки, затем - файлы. Вложенные папки и файлы в узле дерева уже отсортированы
+    (см. _read_dir), поэтому их порядок сохраняется.
 
-    :param root: Корневая папка.
-    :param f: Список содержимого корневой папки.
+    :param node: Папка в дереве документации.
     :return: Список путей к содержимому в папке.
     """
-    file_paths = set()
-    folder_paths = set()
-    for file in f:
-        if (root / file).is_dir():
-            file /= _get_dir_index(file).name
-            folder_paths.add(file)
-        else:
-            # Если смотрим файл содержания текущей папки
-            if file.stem == f'{SPHINX_SERVICE_FILE_PREFIX}.{root.name}':
-                continue
+    folder_paths = [
+        f'{child.path.name}/{dir_page_stem(child.path.name)}.rst' for child in node.dirs
+    ]
+    # Сервисные файлы текущей папки в содержание не попадают
+    file_paths = [file for file in node.files if not _is_generated_file(file, node.path.name)]
+    return folder_paths + file_paths
 
-            file_paths.add(file)
 
-    file_paths_list = natsorted(file_paths, key=lambda x: Path(x).stem)
-    folder_paths_list = natsorted(
-        folder_paths, key=lambda x: Path(x).stem.replace(f'{SPHINX_SERVICE_FILE_PREFIX}.', '')
-    )
-    return folder_paths_list + file_paths_list
+def _is_generated_file(name: str, dirname: str) -> bool:
+    """
+    :param name: Имя файла.
+    :param dirname: Имя папки, в которой находится файл.
+    :return: True, если это сервисный файл папки или одной из частей её содержания.
+    """
+    return is_generated_stem(os.path.splitext(name)[0], dirname)
 
 
-def _iter_dirs(docs_directory: Path, cfg: Config) -> Iterator[Tuple[Path, List[Path]]]:
+def _iter_dirs(tree: DirNode) -> Iterator[DirNode]:
     """
-    Итерируется по папке.
-    Содержимое папки маршрутизируется и сортируется.
+    Итерируется по дереву папок.
+    Вложенные папки обходятся в порядке естественной сортировки (в котором они хранятся в
+    дереве), сразу после родительской.
 
-    :param docs_directory: Папка с документацией.
-    :return: Кортеж из пути до папки и отсортированного содержимого этой папки.
+    :param tree: Корень дерева документации.
+    :return: Непустые папки дерева.
     """
-    mp = _flatmap(docs_directory, cfg)
-    skeys = natsorted(mp.keys())
-    for root in skeys:
-        sub = natsorted(mp[root])
-        yield root, sub
+    if tree.dirs or tree.files:
+        yield tree
+    for child in tree.dirs:
+        yield from _iter_dirs(child)
 
 
-def _flatmap(docs_directory: Path, cfg: Config) -> Dict[Path, Set[Path]]:
+def _scan_tree(
+    docs_directory: Path,
+    exclude_patterns: List[str],
+    source_suffixes: Union[List[str], Dict[str, str]],
+    previous_dirs: Optional[Dict[str, DirRecord]] = None,
+    trusted_before: int = 0,
+    dir_records: Optional[Dict[str, DirRecord]] = None,
+    dirty: Optional[Set[str]] = None,
+    root: str = 'src',
+) -> DirNode:
     """
-        Составляет маршруты файлов с искомыми суффиксами.
-    Суффиксы файлов берутся из конфигурационного файла изначальной папки.
+    Составляет дерево папки src (или другого корня) за один обход с помощью os.scandir.
+
+    Тип каждого элемента папки берётся из DirEntry, поэтому каждый элемент файловой системы
+    проверяется не более одного раза. Игнорирует файлы и папки, указанные в параметре
+    exclude_patterns в конфигурации, а также папки, имена которых начинаются с "_" или ".".
     Для проекта project со структурой
     ::
         project
-        ├── main
-        │   ├── index.rst
-        │   └── second.rst
-        ├── data
-        │   ├── inner_dir
-        │   │   └── data.rst
-        │   └── table.rst
-        └── root.rst
-
-    маршруты будут:
+        └── src
+            ├── main
+            │   ├── index.rst
+            │   └── second.rst
+            ├── data
+            │   ├── inner_dir
+            │   │   └── data.rst
+            │   └── table.rst
+            └── root.rst
+
+    дерево будет:
     ::
-        {project/main:
-            (project/main/index.rst, project/main/second.rst)
-        },
-        {project/data:
-            (project/data/table.rst)
-        },
-        {project/data/inner_dir:
-            (project/data/inner_dir/data.rst)
-        }
+        project/src: (root.rst)
+        ├── project/src/main: (index.rst, second.rst)
+        └── project/src/data: (table.rst)
+            └── project/src/data/inner_dir: (data.rst)
 
     :param docs_directory: Папка с документацией.
-    :return: Маршруты файлов в папке
+    :param exclude_patterns: Шаблоны исключаемых файлов и папок.
+    :param source_suffixes: Суффиксы исходных файлов документации.
+    :param previous_dirs: Содержимое папок из снимка предыдущей сборки. Если указано,
+        просматриваются только папки, время изменения которых поменялось.
+    :param trusted_before: Содержимому из снимка доверяем, только если папка изменилась
+        раньше этого времени (нс).
+    :param dir_records: Сюда записывается содержимое папок текущей сборки.
+    :param dirty: Папки, изменившиеся с предыдущей сборки (пути относительно папки
+        с документацией). Если указано, содержимое остальных папок берётся из снимка без
+        проверки времени изменения.
+    :param root: Путь к корню относительно папки с документацией в формате posix.
+    :return: Корень дерева - папка src.
     """
-    roots: Dict[Path, Set[Path]] = defaultdict(set)
-    for file in _list_files(docs_directory, cfg['exclude_patterns'], cfg['source_suffix']):
-        if file.parent.name and (
-            file.suffix in cfg.source_suffix or (docs_directory / file).is_dir()
-        ):
-            roots[docs_directory / file.parent].add(Path(file.name))
-    return roots
+    return _scan_dir(
+        docs_directory,
+        docs_directory / root,
+        ExcludeMatcher(exclude_patterns),
+        source_suffixes,
+        previous_dirs,
+        trusted_before,
+        {} if dir_records is None else dir_records,
+        dirty,
+    )
 
 
-def _list_files(
+def _scan_dir(
     docs_directory: Path,
-    exclude_patterns: List[str],
+    path: Path,
+    matcher: ExcludeMatcher,
     source_suffixes: Union[List[str], Dict[str, str]],
-) -> Set[Path]:
+    previous_dirs: Optional[Dict[str, DirRecord]],
+    trusted_before: int,
+    dir_records: Dict[str, DirRecord],
+    dirty: Optional[Set[str]],
+) -> DirNode:
     """
-    Составляет список файлов в папках. Игнорирует файлы и папки, указанные в параметре
-    exclude_patterns в конфигурации.
+    Составляет поддерево папки.
 
     :param docs_directory: Папка с документацией.
-    :return: Пути к файлам.
+    :param path: Путь к папке.
+    :param matcher: Шаблоны exclude_patterns из конфигурации.
+    :param source_suffixes: Суффиксы исходных файлов документации.
+    :param previous_dirs: Содержимое папок из снимка предыдущей сборки.
+    :param trusted_before: Время, раньше которого должна измениться папка из снимка (нс).
+    :param dir_records: Содержимое папок текущей сборки.
+    :param dirty: Изменившиеся папки.
+    :return: Поддерево папки.
     """
-    result = set()
-    matcher = Matcher(exclude_patterns)
-    for root, _, files in os.walk(docs_directory):
-        root_path = Path(root)
-        relative_root = root_path.relative_to(docs_directory)
+    relative_path = path.relative_to(docs_directory)
+    key = relative_path.as_posix()
+    record = previous_dirs.get(key) if previous_dirs is not None else None
+    # Папки, в которых по данным отслеживания ничего не менялось, берутся из снимка
+    if record is None or dirty is None or key in dirty:
+        mtime = 0
+        if previous_dirs is not None:
+            mtime = os.stat(path).st_mtime_ns
+        if record is None or record.mtime != mtime or mtime >= trusted_before:
+            record = _read_dir(path, relative_path, matcher, source_suffixes, mtime)
+    dir_records[key] = record
+
+    dirs = []
+    for name in record.dirs:
+        child = _scan_dir(
+            docs_directory,
+            path / name,
+            matcher,
+            source_suffixes,
+            previous_dirs,
+            trusted_before,
+            dir_records,
+            dirty,
+        )
+        if child.dirs or child.files:
+            dirs.append(child)
+    return DirNode(path, dirs, record.files, record.has_readme)
 
-        if matcher(root):
-            continue
 
-        for file in files:
-            file_path = relative_root / file
+@lru_cache(maxsize=None)
+def _natural_keygen() -> Callable[[str], Any]:
+    """
+    :return: Ключ естественной сортировки строк. natsort импортируется при первом вызове.
+    """
+    from natsort import natsort_keygen
+
+    return natsort_keygen()
 
-            underscored = relative_root.name.startswith('_')
-            excluded = matcher(str(file_path))
-            has_proper_suffix = file_path.suffix in source_suffixes
 
-            if underscored or excluded or not has_proper_suffix:
+def _read_dir(
+    path: Path,
+    relative_path: Path,
+    matcher: ExcludeMatcher,
+    source_suffixes: Union[List[str], Dict[str, str]],
+    mtime: int,
+) -> DirRecord:
+    """
+    Просматривает содержимое папки.
+
+    Вложенные папки и файлы сортируются здесь, один раз для папки: папки - в естественном
+    порядке имён, файлы - в естественном порядке имён без суффикса. Отсортированные списки
+    сохраняются в снимке, поэтому папки, взятые из снимка, повторно не сортируются.
+
+    :param path: Путь к папке.
+    :param relative_path: Путь к папке относительно папки с документацией.
+    :param matcher: Шаблоны exclude_patterns из конфигурации.
+    :param source_suffixes: Суффиксы исходных файлов документации.
+    :param mtime: Время изменения папки (нс).
+    :return: Содержимое папки.
+    """
+    natural_key = _natural_keygen()
+    dirs: List[str] = []
+    files: List[Tuple[Any, str]] = []
+    has_readme = False
+    directory = relative_path.as_posix()
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                # Как и os.walk, не заходим в символические ссылки на папки
+                if not entry.is_symlink() and not _is_excluded_dir(
+                    entry.name, relative_path / entry.name, Path(entry.path), matcher
+                ):
+                    dirs.append(sys.intern(entry.name))
                 continue
+            if entry.name == 'README.md':
+                has_readme = True
+            stem, suffix = os.path.splitext(entry.name)
+            # Собственные сервисные файлы папки не делают её непустой
+            if (
+                suffix in source_suffixes
+                and not is_generated_stem(stem, path.name)
+                and not matcher.match_file(directory, entry.name)
+            ):
+                # Одинаковые имена (index.rst и т. п.) в разных папках хранятся один раз
+                files.append((natural_key(stem), sys.intern(entry.name)))
+    dirs.sort(key=natural_key)
+    # Ключ каждого файла вычисляется один раз, при равных ключах порядок задаёт имя
+    files.sort()
+    return DirRecord(mtime, dirs, [name for _, name in files], has_readme)
 
-            result.add(file_path)
-            # [:-1] в родителях файла исключает '.'
-            parent_dirs = list(file_path.parents)[:-1]
-            for parent_dir in parent_dirs:
-                result.add(parent_dir)
 
+def _list_files(
+    docs_directory: Path,
+    exclude_patterns: List[str],
+    source_suffixes: Union[List[str], Dict[str, str]],
+) -> Set[Path]:
+    """
+    Составляет список файлов и папок в папке src. Игнорирует файлы и папки, указанные в
+    параметре exclude_patterns в конфигурации, а также папки, имена которых начинаются с
+    "_" или ".".
+
+    :param docs_directory: Папка с документацией.
+    :return: Пути к файлам и папкам относительно папки с документацией.
+    """
+    result = set()
+    for node in _iter_dirs(_scan_tree(docs_directory, exclude_patterns, source_suffixes)):
+        relative_path = node.path.relative_to(docs_directory)
+        result.add(relative_path)
+        result.update(relative_path / child.path.name for child in node.dirs)
+        result.update(relative_path / file for file in node.files)
     return result
+
+
+def _is_excluded_dir(name: str, relative_path: Path, path: Path, matcher: ExcludeMatcher) -> bool:
+    """
+    Проверяет, нужно ли пропустить папку при обходе.
+
+    :param name: Имя папки.
+    :param relative_path: Путь к папке относительно папки с документацией.
+    :param path: Полный путь к папке.
+    :param matcher: Шаблоны exclude_patterns из конфигурации.
+    :return: True, если папку и всё её содержимое нужно пропустить.
+    """
+    return (
+        name.startswith(('_', '.')) or matcher(relative_path.as_posix()) or matcher(path.as_posix())
+    )
@@ -0,0 +1,120 @@
+"""
+Формирование сервисных файлов sphinx-autotoc без запуска sphinx-build.
+
+Сервисные файлы формируются один раз, после чего сборки разными сборщиками (html, latex,
+linkcheck и т. д.) с параметром ``sphinx_autotoc_pregenerated = True`` их не формируют::
+
+    python -m sphinx_autotoc docs
+    python -m sphinx_autotoc docs --check
+"""
+
+import argparse
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+from sphinx.config import Config
+from sphinx.errors import SphinxError
+
+from sphinx_autotoc import (
+    CONFIG_VALUES,
+    PREGENERATED_CACHE_DIR,
+    _config_key,
+    _page_changed,
+    _page_hash,
+    _relative_key,
+    make_indexes,
+)
+from sphinx_autotoc._snapshot import load_snapshot
+from sphinx_autotoc._stats import IndexStats
+
+
+def load_config(confdir: Path) -> Config:
+    """
+    Читает conf.py. Расширения не загружаются, регистрируются только параметры sphinx-autotoc
+    и autosummary_generate. Как и при сборке, параметры регистрируются до init_values:
+    значения из conf.py получают только зарегистрированные параметры.
+
+    :param confdir: Папка с файлом conf.py.
+    :return: Конфигурация Sphinx.
+    """
+    cfg = Config.read(str(confdir))
+    cfg.pre_init_values()
+    for name, default, rebuild, types in CONFIG_VALUES:
+        cfg.add(name, default, rebuild, types)
+    if 'sphinx.ext.autosummary' in cfg.extensions:
+        cfg.add('autosummary_generate', True, 'env', (bool, list))
+    cfg.init_values()
+    # Как и sphinx.config.convert_source_suffix при сборке
+    source_suffix = cfg['source_suffix']
+    if isinstance(source_suffix, str):
+        cfg['source_suffix'] = {source_suffix: None}
+    elif isinstance(source_suffix, (list, tuple)):
+        cfg['source_suffix'] = dict.fromkeys(source_suffix)
+    return cfg
+
+
+def outdated_pages(docs_directory: Path, cfg: Config) -> List[str]:
+    """
+    Формирует сервисные файлы, ничего не записывая.
+
+    :param docs_directory: Папка с документацией.
+    :param cfg: Конфигурация Sphinx.
+    :return: Действия, которые выполнила бы команда без --check и --dry-run: 'write <путь>'
+        для новых и изменившихся файлов и 'remove <путь>' для устаревших файлов, которые
+        не менялись после записи.
+    """
+    pages = make_indexes(docs_directory, cfg, write=False)
+    actions = [
+        f'write {_relative_key(docs_directory, path)}'
+        for path, content in pages.items()
+        if _page_changed(path, content)
+    ]
+    previous = load_snapshot(docs_directory / PREGENERATED_CACHE_DIR, _config_key(cfg))
+    produced = {_relative_key(docs_directory, path) for path in pages}
+    actions += [
+        f'remove {key}'
+        for key in sorted(previous.pages.keys() - produced)
+        if _page_hash(docs_directory / key) == previous.pages[key][0]
+    ]
+    return actions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='sphinx-autotoc', description=__doc__.splitlines()[1].rstrip('.')
+    )
+    parser.add_argument(
+        'sourcedir', type=Path, nargs='?', default=Path(), help='папка с документацией'
+    )
+    parser.add_argument(
+        '-c', '--confdir', type=Path, help='папка с conf.py (по умолчанию - папка с документацией)'
+    )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        '--check', action='store_true', help='завершиться с кодом 1, если файлы устарели'
+    )
+    mode.add_argument(
+        '--dry-run', action='store_true', help='вывести изменения, ничего не записывая'
+    )
+    args = parser.parse_args(argv)
+
+    docs_directory = args.sourcedir.resolve()
+    try:
+        cfg = load_config(args.confdir or docs_directory)
+        if args.check or args.dry_run:
+            actions = outdated_pages(docs_directory, cfg)
+            for action in actions:
+                print(action)
+            return 1 if args.check and actions else 0
+        stats = IndexStats()
+        make_indexes(docs_directory, cfg, docs_directory / PREGENERATED_CACHE_DIR, stats=stats)
+    except SphinxError as exc:
+        print(f'sphinx-autotoc: {exc}', file=sys.stderr)
+        return 2
+    print(stats.summary())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
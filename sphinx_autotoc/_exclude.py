@@ -0,0 +1,82 @@
+"""
+Проверка путей по шаблонам exclude_patterns.
+
+sphinx.util.matching.Matcher проверяет путь по каждому шаблону отдельно. Здесь шаблоны без
+подстановочных символов проверяются поиском в множестве, а остальные объединяются в одно
+регулярное выражение. Для файлов папки выражение составляется только из шаблонов, которые
+могут совпасть с путями в этой папке, и запоминается для папки.
+"""
+
+import re
+from typing import Dict, Iterable, List, Optional, Pattern, Tuple
+
+from sphinx.util.matching import _translate_pattern
+
+GLOB_CHARS = re.compile(r'[*?[]')
+
+
+class ExcludeMatcher:
+    """Шаблоны exclude_patterns, совпадающие с путями так же, как в Matcher из Sphinx."""
+
+    def __init__(self, exclude_patterns: Iterable[str]) -> None:
+        """
+        :param exclude_patterns: Шаблоны исключаемых файлов и папок.
+        """
+        patterns = list(exclude_patterns)
+        # Как и Matcher, шаблон "**/name" совпадает и с "name"
+        patterns += [pattern[3:] for pattern in patterns if pattern.startswith('**/')]
+        self._literals = {pattern for pattern in patterns if not GLOB_CHARS.search(pattern)}
+        self._globs: List[Tuple[str, str]] = [
+            (GLOB_CHARS.split(pattern, 1)[0], _translate_pattern(pattern))
+            for pattern in patterns
+            if GLOB_CHARS.search(pattern)
+        ]
+        """Неизменная часть шаблона до первого подстановочного символа и регулярное выражение."""
+        self._regex = _combine(regex for _, regex in self._globs)
+        self._dir_regexes: Dict[str, Optional[Pattern[str]]] = {}
+
+    def __call__(self, path: str) -> bool:
+        """
+        :param path: Путь в формате posix.
+        :return: True, если путь совпадает с одним из шаблонов.
+        """
+        if path in self._literals:
+            return True
+        return self._regex is not None and self._regex.match(path) is not None
+
+    def match_file(self, directory: str, name: str) -> bool:
+        """
+        :param directory: Путь к папке относительно папки с документацией в формате posix.
+        :param name: Имя файла.
+        :return: True, если путь к файлу совпадает с одним из шаблонов.
+        """
+        path = f'{directory}/{name}'
+        if path in self._literals:
+            return True
+        regex = self._dir_regex(directory)
+        return regex is not None and regex.match(path) is not None
+
+    def _dir_regex(self, directory: str) -> Optional[Pattern[str]]:
+        """
+        :param directory: Путь к папке в формате posix.
+        :return: Регулярное выражение из шаблонов, которые могут совпасть с путями к файлам
+            папки, или None, если таких шаблонов нет.
+        """
+        if directory not in self._dir_regexes:
+            prefix = f'{directory}/'
+            self._dir_regexes[directory] = _combine(
+                regex
+                for literal, regex in self._globs
+                if literal.startswith(prefix) or prefix.startswith(literal)
+            )
+        return self._dir_regexes[directory]
+
+
+def _combine(regexes: Iterable[str]) -> Optional[Pattern[str]]:
+    """
+    :param regexes: Регулярные выражения шаблонов.
+    :return: Выражение, совпадающее со строкой, если с ней совпадает любое из выражений, или
+        None, если выражений нет.
+    """
+    alternatives = [f'(?:{regex})' for regex in regexes]
+    return re.compile('|'.join(alternatives)) if alternatives else None
@@ -0,0 +1,63 @@
+"""
+Список файлов дерева документации по индексу git (sphinx_autotoc_git_index).
+
+В CI рабочая копия каждый раз создаётся заново: время изменения папок не совпадает
+с сохранённым в снимке, и дерево приходится обходить целиком. Список файлов рабочей копии
+git хранит в индексе, поэтому его можно получить командой git ls-files без обхода папок
+(сеть при этом не используется). По списку составляется отпечаток дерева: если он не
+изменился с предыдущей сборки, сервисные файлы берутся из снимка.
+"""
+
+import os
+import subprocess
+from pathlib import Path
+from typing import List, Optional, Set
+
+from sphinx.util import logging
+
+logger = logging.getLogger(__name__)
+
+# Метки git ls-files -t: файл удалён из рабочей копии, файл исключён из рабочей копии
+# (sparse checkout)
+MISSING_TAGS = ('R', 'S')
+
+
+def git_files(directory: Path, paths: List[str]) -> Optional[List[str]]:
+    """
+    :param directory: Папка с документацией.
+    :param paths: Пути к папкам относительно папки с документацией в формате posix.
+    :return: Пути к файлам в этих папках относительно папки с документацией в формате posix:
+        файлы из индекса git, кроме удалённых из рабочей копии, и неотслеживаемые файлы, не
+        исключённые .gitignore. None, если папка не находится в рабочей копии git или git не
+        установлен.
+    """
+    command = [
+        'git',
+        '--literal-pathspecs',
+        '-C',
+        str(directory),
+        'ls-files',
+        '-z',
+        '-t',
+        '--cached',
+        '--deleted',
+        '--others',
+        '--exclude-standard',
+        '--',
+        *paths,
+    ]
+    try:
+        result = subprocess.run(command, capture_output=True, check=True)
+    except (OSError, subprocess.CalledProcessError) as exc:
+        logger.info('autotoc: git file list is unavailable, walking the tree: %s', exc)
+        return None
+
+    files: Set[str] = set()
+    missing: Set[str] = set()
+    for entry in result.stdout.split(b'\0'):
+        if not entry:
+            continue
+        # Запись имеет вид "<метка> <путь>"
+        tag, path = entry[:1].decode(), os.fsdecode(entry[2:])
+        (missing if tag in MISSING_TAGS else files).add(path)
+    return sorted(files - missing)
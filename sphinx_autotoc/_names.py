@@ -0,0 +1,37 @@
+"""
+Имена сервисных файлов папок.
+"""
+
+import re
+
+SHARD_SUFFIX = re.compile(r'\.part-\d+')
+
+
+def dir_page_stem(dirname: str) -> str:
+    """
+    :param dirname: Имя папки.
+    :return: Имя сервисного файла папки без суффикса.
+    """
+    return f'autotoc.{dirname}'
+
+
+def shard_page_stem(dirname: str, number: int, width: int) -> str:
+    """
+    :param dirname: Имя папки.
+    :param number: Номер части содержания папки, начиная с 1.
+    :param width: Число цифр в номере.
+    :return: Имя сервисного файла части содержания папки без суффикса.
+    """
+    return f'{dir_page_stem(dirname)}.part-{number:0{width}d}'
+
+
+def is_generated_stem(stem: str, dirname: str) -> bool:
+    """
+    :param stem: Имя файла без суффикса.
+    :param dirname: Имя папки, в которой находится файл.
+    :return: True, если это сервисный файл папки или одной из частей её содержания.
+    """
+    own = dir_page_stem(dirname)
+    if stem == own:
+        return True
+    return stem.startswith(own) and SHARD_SUFFIX.fullmatch(stem, len(own)) is not None
@@ -0,0 +1,86 @@
+"""
+Сервисные файлы, изменившиеся с предыдущей сборки.
+
+Хэши сервисных файлов сохраняются в окружении Sphinx между сборками. Sphinx перечитывает
+только сервисные файлы, содержимое которых изменилось, а страницы родительских папок вплоть
+до индексной страницы только перезаписывает: их содержимое прежнее, но изменилась навигация
+по вложенным страницам.
+"""
+
+import hashlib
+from pathlib import Path, PurePosixPath
+from typing import Dict, Iterator, List, Set
+
+from sphinx.application import Sphinx
+from sphinx.environment import BuildEnvironment
+
+# Атрибуты окружения Sphinx: хэши сервисных файлов (имя документа: хэш), изменившиеся
+# сервисные файлы и их родители.
+HASHES_ATTR = 'sphinx_autotoc_hashes'
+CHANGED_ATTR = 'sphinx_autotoc_changed_pages'
+ANCESTORS_ATTR = 'sphinx_autotoc_ancestor_pages'
+
+
+def track_pages(app: Sphinx, pages: Dict[Path, str]) -> None:
+    """
+    Сравнивает сформированные сервисные файлы с файлами предыдущей сборки.
+
+    :param app: Приложение Sphinx.
+    :param pages: Словарь путь к сервисному файлу: содержимое. Пустой словарь означает, что
+        дерево документации не изменилось.
+    """
+    env = app.env
+    changed: Set[str] = set()
+    ancestors: Set[str] = set()
+    if pages:
+        srcdir = Path(app.srcdir)
+        hashes = {
+            docname(srcdir, path): hashlib.sha1(content.encode('utf8')).hexdigest()
+            for path, content in pages.items()
+        }
+        previous: Dict[str, str] = getattr(env, HASHES_ATTR, {})
+        changed = {name for name, digest in hashes.items() if previous.get(name) != digest}
+        # Удалённая папка пропадает из содержания родителя, как и добавленная
+        for name in changed | (previous.keys() - hashes.keys()):
+            ancestors.update(_ancestors(name, hashes, app.config.root_doc))
+        setattr(env, HASHES_ATTR, hashes)
+    setattr(env, CHANGED_ATTR, changed)
+    setattr(env, ANCESTORS_ATTR, ancestors - changed)
+
+
+def get_changed_pages(
+    app: Sphinx, env: BuildEnvironment, added: Set[str], changed: Set[str], removed: Set[str]
+) -> List[str]:
+    """
+    :return: Сервисные файлы, содержимое которых изменилось с предыдущей сборки.
+    """
+    return sorted(getattr(env, CHANGED_ATTR, set()))
+
+
+def get_ancestor_pages(app: Sphinx, env: BuildEnvironment) -> List[str]:
+    """
+    :return: Сервисные файлы родительских папок, навигацию которых нужно перезаписать.
+    """
+    return sorted(getattr(env, ANCESTORS_ATTR, set()) & env.all_docs.keys())
+
+
+def docname(srcdir: Path, path: Path) -> str:
+    return path.relative_to(srcdir).with_suffix('').as_posix()
+
+
+def _ancestors(name: str, docnames: Dict[str, str], root_doc: str) -> Iterator[str]:
+    """
+    :param name: Имя сервисного файла папки или части её содержания.
+    :param docnames: Имена сервисных файлов текущей сборки.
+    :param root_doc: Имя индексной страницы.
+    :return: Имена сервисных файлов родительских папок.
+    """
+    # Для части содержания папки родитель - сервисный файл этой же папки
+    folder = PurePosixPath(name).parent
+    while folder.name:
+        parent = (folder / f'autotoc.{folder.name}').as_posix()
+        if parent != name and parent in docnames:
+            yield parent
+        folder = folder.parent
+    if root_doc in docnames:
+        yield root_doc
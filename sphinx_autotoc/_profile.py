@@ -0,0 +1,105 @@
+"""
+Профилирование формирования содержания (sphinx_autotoc_profile).
+
+При 'cpu' формирование выполняется под cProfile, результат сохраняется в папку сборки
+в файл sphinx_autotoc.prof (открывается pstats, snakeviz и т. п.). При 'memory' выделения
+памяти отслеживаются tracemalloc, в файл sphinx_autotoc.memory.txt записываются пиковый
+объём памяти и строки кода, выделившие больше всего памяти.
+"""
+
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from sphinx.errors import ExtensionError
+from sphinx.util import logging
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = ('', 'cpu', 'memory')
+CPU_PROFILE_FILE_NAME = 'sphinx_autotoc.prof'
+MEMORY_REPORT_FILE_NAME = 'sphinx_autotoc.memory.txt'
+MEMORY_TOP = 25
+"""Число строк кода в отчёте о памяти."""
+
+
+@contextmanager
+def profile(mode: str, outdir: Path) -> Iterator[None]:
+    """
+    Профилирует код внутри блока with.
+
+    :param mode: Значение параметра sphinx_autotoc_profile: '' (выключено), 'cpu' или 'memory'.
+    :param outdir: Папка, в которую сохраняется результат.
+    """
+    if mode not in PROFILE_MODES:
+        errormsg = (
+            f'Недопустимое значение sphinx_autotoc_profile: {mode!r}. '
+            f'Допустимые значения: {", ".join(map(repr, PROFILE_MODES))}.'
+        )
+        raise ExtensionError(errormsg)
+    if mode == 'cpu':
+        with _cpu_profile(outdir / CPU_PROFILE_FILE_NAME):
+            yield
+    elif mode == 'memory':
+        with _memory_profile(outdir / MEMORY_REPORT_FILE_NAME):
+            yield
+    else:
+        yield
+
+
+@contextmanager
+def _cpu_profile(path: Path) -> Iterator[None]:
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(str(path))
+        logger.info('autotoc: CPU profile written to %s', path)
+
+
+@contextmanager
+def _memory_profile(path: Path) -> Iterator[None]:
+    # Если tracemalloc уже включён (python -X tracemalloc), он не выключается
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    if hasattr(tracemalloc, 'reset_peak'):  # Python 3.9+
+        tracemalloc.reset_peak()
+    try:
+        yield
+    finally:
+        after = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if started:
+            tracemalloc.stop()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf8') as f:
+            f.write(_memory_report(before, after, current, peak))
+        logger.info('autotoc: memory report written to %s', path)
+
+
+def _memory_report(
+    before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, current: int, peak: int
+) -> str:
+    """
+    :param before: Снимок памяти до формирования.
+    :param after: Снимок памяти после формирования.
+    :param current: Объём отслеживаемой памяти после формирования (байт).
+    :param peak: Пиковый объём отслеживаемой памяти (байт).
+    :return: Текст отчёта.
+    """
+    differences = after.compare_to(before, 'lineno')
+    lines = [
+        f'Peak traced memory: {peak / 1024:.1f} KiB',
+        f'Traced memory after generation: {current / 1024:.1f} KiB',
+        '',
+        f'Top {MEMORY_TOP} lines by memory allocated during generation:',
+    ]
+    lines.extend(str(difference) for difference in differences[:MEMORY_TOP])
+    return '\n'.join(lines) + '\n'
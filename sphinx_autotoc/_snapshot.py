@@ -0,0 +1,122 @@
+"""
+Снимок дерева документации, сохраняемый между сборками.
+
+По снимку при следующей сборке повторно просматриваются только те папки, время изменения
+которых поменялось, а если не изменилось ничего - сервисные файлы не формируются заново.
+"""
+
+import os
+import pickle
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sphinx.util import logging
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILE_NAME = 'sphinx_autotoc.pickle'
+SNAPSHOT_VERSION = 4
+# Папки, изменённые незадолго до обхода, могут измениться ещё раз с тем же временем
+# изменения (на файловых системах с грубым разрешением времени), поэтому им не доверяем.
+MTIME_GRANULARITY_NS = 2 * 10**9
+
+FileSignature = Tuple[int, int]  # время изменения (нс), размер
+
+
+class DirRecord(NamedTuple):
+    """Содержимое папки на момент обхода."""
+
+    mtime: int
+    """Время изменения папки (нс)."""
+    dirs: List[str]
+    """Имена вложенных папок, не исключённых из обхода, в естественном порядке."""
+    files: List[str]
+    """Имена исходных файлов документации в естественном порядке."""
+    has_readme: bool
+    """Есть ли в папке файл README.md."""
+
+
+class Snapshot(NamedTuple):
+    """Снимок дерева документации и сформированных по нему сервисных файлов."""
+
+    config: str
+    """Значения параметров конфигурации, от которых зависит результат."""
+    scan_time: int
+    """Время начала обхода (нс)."""
+    dirs: Dict[str, DirRecord]
+    """Содержимое папок, ключ - путь относительно папки с документацией."""
+    inputs: Dict[str, FileSignature]
+    """Сигнатуры прочитанных файлов (README, autosummary)."""
+    readmes: Dict[str, str]
+    """Содержимое файлов README."""
+    autosummary: Dict[str, Tuple[str, str]]
+    """Заголовок и имя модуля файлов, в которых найдена директива autosummary."""
+    pages: Dict[str, Tuple[str, FileSignature]]
+    """Хэш содержимого и сигнатура записанных сервисных файлов."""
+    fingerprint: str = ''
+    """Отпечаток дерева по индексу git (sphinx_autotoc_git_index)."""
+    contents: Dict[str, str] = {}
+    """Содержимое сервисных файлов. Сохраняется только вместе с отпечатком дерева."""
+
+
+def empty_snapshot(config: str) -> Snapshot:
+    return Snapshot(config, 0, {}, {}, {}, {}, {})
+
+
+def load_snapshot(cache_dir: Path, config: str, keep_pages: bool = True) -> Snapshot:
+    """
+    Загружает снимок предыдущей сборки.
+
+    :param cache_dir: Папка, в которой хранится снимок.
+    :param config: Значения параметров конфигурации текущей сборки.
+    :param keep_pages: Сохранять ли сведения о записанных файлах из снимка с другой
+        конфигурацией.
+    :return: Снимок или пустой снимок, если он отсутствует, повреждён или сделан с другой
+        конфигурацией. Из снимка с другой конфигурацией сохраняются сведения о записанных
+        файлах, если keep_pages.
+    """
+    try:
+        with open(cache_dir / SNAPSHOT_FILE_NAME, 'rb') as f:
+            version, snapshot = pickle.load(f)
+    except FileNotFoundError:
+        return empty_snapshot(config)
+    except Exception as exc:
+        logger.debug('Failed to load autotoc snapshot: %s', exc)
+        return empty_snapshot(config)
+
+    if version != SNAPSHOT_VERSION or not isinstance(snapshot, Snapshot):
+        return empty_snapshot(config)
+    if snapshot.config != config:
+        logger.info('autotoc configuration changed, rebuilding the tree')
+        if not keep_pages:
+            return empty_snapshot(config)
+        # Записанные файлы остаются на диске при любой конфигурации, их список нужен, чтобы
+        # не перезаписывать их без изменений и удалять устаревшие
+        return empty_snapshot(config)._replace(pages=snapshot.pages)
+    return snapshot
+
+
+def save_snapshot(cache_dir: Path, snapshot: Snapshot) -> None:
+    """
+    Сохраняет снимок для следующей сборки.
+
+    :param cache_dir: Папка, в которой хранится снимок.
+    :param snapshot: Снимок.
+    """
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_dir / f'{SNAPSHOT_FILE_NAME}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump((SNAPSHOT_VERSION, snapshot), f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_dir / SNAPSHOT_FILE_NAME)
+
+
+def file_signature(path: Path) -> Optional[FileSignature]:
+    """
+    :param path: Путь к файлу.
+    :return: Время изменения и размер файла или None, если файла нет.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
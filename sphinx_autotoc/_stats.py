@@ -0,0 +1,81 @@
+"""
+Время этапов и счётчики формирования содержания.
+"""
+
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field, fields
+from typing import Any, Dict, Iterator
+
+
+@dataclass
+class IndexStats:
+    """Время этапов (с) и счётчики одного запуска make_indexes."""
+
+    timings: Dict[str, float] = field(default_factory=dict)
+    """Время этапов: обход (walk), группировка (grouping), сортировка (sorting),
+    формирование (rendering), запись (writing), удаление устаревших файлов (cleanup),
+    разбор autosummary (autosummary), чтение README (readme), обход и формирование корней
+    в пуле процессов (roots)."""
+    directories: int = 0
+    """Число папок с документацией."""
+    files: int = 0
+    """Число исходных файлов документации."""
+    files_written: int = 0
+    """Число записанных сервисных файлов."""
+    files_skipped: int = 0
+    """Число сервисных файлов, которые не изменились и не записывались."""
+    bytes_written: int = 0
+    """Объём записанных сервисных файлов (байт)."""
+    files_removed: int = 0
+    """Число удалённых устаревших сервисных файлов."""
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Замеряет время этапа. Время повторяющихся этапов суммируется.
+
+        :param name: Название этапа.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def merge(self, other: 'IndexStats', timings: bool = True, counters: bool = True) -> None:
+        """
+        Добавляет время этапов и счётчики другого запуска (например, обработки одного корня).
+
+        :param other: Добавляемые время этапов и счётчики.
+        :param timings: Добавлять ли время этапов.
+        :param counters: Добавлять ли счётчики.
+        """
+        if timings:
+            for name, seconds in other.timings.items():
+                self.timings[name] = self.timings.get(name, 0.0) + seconds
+        if counters:
+            for item in fields(self):
+                if item.name != 'timings':
+                    setattr(self, item.name, getattr(self, item.name) + getattr(other, item.name))
+
+    @property
+    def total(self) -> float:
+        return sum(self.timings.values())
+
+    def summary(self) -> str:
+        """
+        :return: Однострочная сводка для журнала.
+        """
+        timings = ', '.join(f'{name} {seconds:.3f}s' for name, seconds in self.timings.items())
+        return (
+            f'{self.directories} dirs, {self.files} files; '
+            f'{self.files_written} written ({self.bytes_written} bytes), '
+            f'{self.files_skipped} unchanged, {self.files_removed} removed; '
+            f'{self.total:.3f}s ({timings})'
+        )
+
+    def as_dict(self) -> Dict[str, Any]:
+        result = asdict(self)
+        result['total'] = self.total
+        return result
@@ -0,0 +1,85 @@
+"""
+Виртуальные сервисные файлы.
+
+Сервисные файлы не записываются в папку с документацией: Sphinx узнаёт о них через
+событие env-get-outdated, а их содержимое подставляется в событии source-read.
+"""
+
+from pathlib import Path
+from typing import Any, Dict, List, Set
+
+from sphinx.application import Sphinx
+from sphinx.environment import BuildEnvironment
+from sphinx.errors import ExtensionError
+
+from sphinx_autotoc._outdated import docname
+
+# Атрибут окружения Sphinx с содержимым виртуальных документов (имя документа: содержимое).
+PAGES_ATTR = 'sphinx_autotoc_pages'
+# Пустой файл, который Sphinx открывает вместо виртуального документа. Он лежит в папке
+# doctree, а не в папке с документацией.
+PLACEHOLDER_FILE_NAME = 'sphinx_autotoc_virtual.rst'
+
+
+def register_pages(app: Sphinx, pages: Dict[Path, str]) -> None:
+    """
+    Запоминает сформированные сервисные файлы как виртуальные документы.
+
+    :param app: Приложение Sphinx.
+    :param pages: Словарь путь к сервисному файлу: содержимое. Пустой словарь отключает
+        виртуальные документы, оставшиеся от предыдущей сборки.
+    """
+    srcdir = Path(app.srcdir)
+    documents = {docname(srcdir, path): content for path, content in pages.items()}
+    setattr(app.env, PAGES_ATTR, documents)
+
+    placeholder = Path(app.doctreedir) / PLACEHOLDER_FILE_NAME
+    if documents and not placeholder.is_file():
+        placeholder.parent.mkdir(parents=True, exist_ok=True)
+        placeholder.touch()
+
+
+def add_virtual_docs(
+    app: Sphinx, env: BuildEnvironment, added: Set[str], changed: Set[str], removed: Set[str]
+) -> List[str]:
+    """
+    Добавляет виртуальные документы к найденным Sphinx документам. Изменившиеся документы
+    сообщаются отдельно, вместе с записываемыми на диск сервисными файлами.
+    """
+    documents: Dict[str, str] = getattr(env, PAGES_ATTR, {})
+    if not documents:
+        return []
+    docname_to_path = getattr(env.project, '_docname_to_path', None)
+    if docname_to_path is None:
+        errormsg = 'Виртуальные сервисные файлы требуют Sphinx 7.2 или новее.'
+        raise ExtensionError(errormsg)
+
+    placeholder = str(Path(app.doctreedir) / PLACEHOLDER_FILE_NAME)
+    for name in documents:
+        env.project.docnames.add(name)
+        docname_to_path[name] = placeholder
+        removed.discard(name)
+        if name not in env.all_docs:
+            added.add(name)
+    return []
+
+
+def read_virtual_doc(app: Sphinx, docname: str, source: List[str]) -> None:
+    """
+    Подставляет содержимое виртуального документа вместо пустого файла-заглушки.
+    """
+    documents: Dict[str, str] = getattr(app.env, PAGES_ATTR, {})
+    if docname in documents:
+        source[0] = documents[docname]
+
+
+def hide_virtual_source(
+    app: Sphinx, pagename: str, templatename: str, context: Dict[str, Any], doctree: Any
+) -> None:
+    """
+    Убирает ссылку на исходный файл со страниц виртуальных документов: исходного файла у них
+    нет, а копировать пустую заглушку бессмысленно.
+    """
+    if pagename in getattr(app.env, PAGES_ATTR, {}):
+        context['sourcename'] = ''
+        context['page_source_suffix'] = Path(PLACEHOLDER_FILE_NAME).suffix
@@ -0,0 +1,247 @@
+"""
+Отслеживание изменений папки src в долго работающем процессе.
+
+Дерево документации и сформированные сервисные файлы хранятся в памяти между сборками
+одного процесса (например, сервера документации, который пересобирает проект при
+изменениях). При следующей сборке повторно просматриваются только папки, в которых
+создавались, удалялись или переименовывались файлы, а заново формируются только их сервисные
+файлы и сервисные файлы родительских папок.
+
+Изменения отслеживаются через inotify (Linux). Если inotify недоступен, время изменения
+папок проверяется при каждой сборке, как и при обычной инкрементальной сборке. Так же
+проверяются папки, которые inotify не смог отслеживать (например, при исчерпании лимита
+fs.inotify.max_user_watches).
+"""
+
+import atexit
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import sys
+from pathlib import Path
+from typing import Dict, Optional, Set
+
+from sphinx.errors import ExtensionError
+from sphinx.util import logging
+
+from sphinx_autotoc._names import is_generated_stem
+from sphinx_autotoc._snapshot import DirRecord, Snapshot
+
+logger = logging.getLogger(__name__)
+
+WATCH_MODES = ('', 'auto', 'inotify', 'poll')
+
+# Константы из <sys/inotify.h>
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+class WatchBackend:
+    """
+    Способ отслеживания изменений. Базовый класс служит запасным способом: изменения
+    не отслеживаются, при каждой сборке проверяется время изменения всех папок.
+    """
+
+    def watch(self, key: str) -> None:
+        pass
+
+    def unwatch(self, key: str) -> None:
+        pass
+
+    def changes(self) -> Optional[Set[str]]:
+        """
+        :return: None - изменившиеся папки неизвестны.
+        """
+        return None
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyBackend(WatchBackend):
+    """Отслеживание изменений через inotify. Каждая папка дерева отслеживается отдельно."""
+
+    def __init__(self, docs_directory: Path) -> None:
+        """
+        :param docs_directory: Папка с документацией.
+        :raises OSError: inotify недоступен.
+        """
+        if not sys.platform.startswith('linux'):
+            errormsg = 'inotify доступен только в Linux'
+            raise OSError(errormsg)
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._docs_directory = docs_directory
+        self._keys: Dict[int, str] = {}  # дескриптор отслеживания: папка
+        self._descriptors: Dict[str, int] = {}  # папка: дескриптор отслеживания
+        self._dirty: Set[str] = set()
+        self._unwatched: Set[str] = set()
+        """Папки, которые не удалось отслеживать: они проверяются при каждой сборке."""
+        self._overflow = False
+
+    def watch(self, key: str) -> None:
+        """
+        Начинает отслеживать папку. Папка отслеживается после обхода, поэтому файлы,
+        созданные в ней между обходом и началом отслеживания, могли быть пропущены: при
+        следующей сборке папка просматривается заново.
+
+        :param key: Путь к папке относительно папки с документацией.
+        """
+        path = os.fsencode(self._docs_directory / key)
+        wd = self._libc.inotify_add_watch(self._fd, path, WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            # Папку удалили после обхода, это будет видно по событию в родительской папке
+            if error != errno.ENOENT:
+                if not self._unwatched:
+                    logger.warning(
+                        'autotoc: cannot watch %s (%s), checking such folders on every build',
+                        key,
+                        os.strerror(error),
+                    )
+                self._unwatched.add(key)
+            return
+        self._keys[wd] = key
+        self._descriptors[key] = wd
+        self._dirty.add(key)
+
+    def unwatch(self, key: str) -> None:
+        """
+        :param key: Путь к папке относительно папки с документацией.
+        """
+        self._unwatched.discard(key)
+        wd = self._descriptors.pop(key, None)
+        if wd is not None:
+            self._keys.pop(wd, None)
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def changes(self) -> Optional[Set[str]]:
+        """
+        Читает накопившиеся события.
+
+        :return: Папки, в которых создавались, удалялись или переименовывались файлы и папки,
+            и папки, которые не удалось отслеживать, или None, если очередь событий
+            переполнилась.
+        """
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            self._parse(data)
+        dirty, self._dirty = self._dirty, set()
+        overflow, self._overflow = self._overflow, False
+        return None if overflow else dirty | self._unwatched
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+    def _parse(self, data: bytes) -> None:
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                self._overflow = True
+                continue
+            key = self._keys.get(wd)
+            if key is None:
+                continue
+            # Сервисные файлы папки создаются самим расширением и не меняют её содержимое
+            stem, suffix = os.path.splitext(name)
+            if mask & IN_CREATE and suffix == '.rst' and is_generated_stem(stem, Path(key).name):
+                continue
+            self._dirty.add(key)
+
+
+class TreeWatcher:
+    """Дерево документации и сервисные файлы, хранящиеся в памяти между сборками."""
+
+    def __init__(self, docs_directory: Path, mode: str) -> None:
+        """
+        :param docs_directory: Папка с документацией.
+        :param mode: Способ отслеживания: 'auto', 'inotify' или 'poll'.
+        """
+        self.snapshot: Optional[Snapshot] = None
+        """Снимок дерева последней сборки."""
+        self.pages: Dict[Path, str] = {}
+        """Сервисные файлы последней сборки."""
+        self.backend = WatchBackend()
+        if mode in ('auto', 'inotify'):
+            try:
+                self.backend = InotifyBackend(docs_directory)
+            except (OSError, AttributeError) as exc:
+                if mode == 'inotify':
+                    errormsg = f'Не удалось включить inotify: {exc}'
+                    raise ExtensionError(errormsg) from exc
+                logger.info('autotoc: inotify is unavailable (%s), polling the tree', exc)
+        self._watched: Set[str] = set()
+
+    def changes(self) -> Optional[Set[str]]:
+        """
+        :return: Пути к изменившимся папкам относительно папки с документацией или None,
+            если изменившиеся папки неизвестны и нужно проверить все.
+        """
+        return self.backend.changes()
+
+    def sync(self, dir_records: Dict[str, DirRecord]) -> None:
+        """
+        Отслеживает папки текущего дерева и перестаёт отслеживать удалённые.
+
+        :param dir_records: Содержимое папок текущей сборки.
+        """
+        for key in self._watched - dir_records.keys():
+            self.backend.unwatch(key)
+        for key in dir_records.keys() - self._watched:
+            self.backend.watch(key)
+        self._watched = set(dir_records)
+
+    def close(self) -> None:
+        self.backend.close()
+
+
+_watchers: Dict[Path, TreeWatcher] = {}
+
+
+def get_watcher(docs_directory: Path, mode: str) -> Optional[TreeWatcher]:
+    """
+    Возвращает отслеживание папки с документацией, созданное в этом процессе ранее, или
+    создаёт новое.
+
+    :param docs_directory: Папка с документацией.
+    :param mode: Значение параметра sphinx_autotoc_watch.
+    :return: Отслеживание или None, если оно выключено.
+    """
+    if mode not in WATCH_MODES:
+        errormsg = (
+            f'Недопустимое значение sphinx_autotoc_watch: {mode!r}. '
+            f'Допустимые значения: {", ".join(map(repr, WATCH_MODES))}.'
+        )
+        raise ExtensionError(errormsg)
+    if not mode:
+        return None
+    if docs_directory not in _watchers:
+        _watchers[docs_directory] = TreeWatcher(docs_directory, mode)
+    return _watchers[docs_directory]
+
+
+@atexit.register
+def _close_watchers() -> None:
+    for watcher in _watchers.values():
+        watcher.close()
+    _watchers.clear()
@@ -0,0 +1,32 @@
+import shutil
+from pathlib import Path
+from typing import List, Set
+
+import pytest
+
+PROJECTS_DIR = Path(__file__).parent / 'make_indexes_test_projects'
+PROJECT_DIR = PROJECTS_DIR / '3_levels_of_nesting'
+
+
+def ignore_generated(directory: str, names: List[str]) -> Set[str]:
+    """Не копирует сервисные файлы, оставшиеся от запусков в папке тестового проекта."""
+    return {
+        name for name in names if name.startswith('autotoc.') and name != 'autotoc.autosummary.rst'
+    }
+
+
+def copy_project(name: str, tmp_path: Path) -> Path:
+    """
+    :param name: Имя тестового проекта.
+    :param tmp_path: Временная папка.
+    :return: Путь к копии проекта во временной папке.
+    """
+    project_path = tmp_path / name
+    shutil.copytree(PROJECTS_DIR / name, project_path, ignore=ignore_generated)
+    return project_path
+
+
+@pytest.fixture
+def project_path(tmp_path: Path) -> Path:
+    """Копия проекта 3_levels_of_nesting во временной папке."""
+    return copy_project(PROJECT_DIR.name, tmp_path)
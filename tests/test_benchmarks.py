@@ -0,0 +1,38 @@
+import json
+from pathlib import Path
+
+from benchmarks.bench_import import import_times
+from benchmarks.bench_make_indexes import generate_tree, main
+
+
+def test_generate_tree(tmp_path: Path) -> None:
+    created = generate_tree(tmp_path, depth=2, fanout=2, files=3, readme=True, autosummary=True)
+    assert created == 21
+    assert len(list((tmp_path / 'src').rglob('*. page.rst'))) == created
+    assert len(list((tmp_path / 'src').rglob('autotoc.autosummary.rst'))) == 6
+    assert (tmp_path / 'src' / '0. folder' / 'README.md').is_file()
+
+
+def test_generate_tree_max_files(tmp_path: Path) -> None:
+    assert generate_tree(tmp_path, depth=3, fanout=3, files=10, max_files=25) == 25
+
+
+def test_benchmark_writes_json(tmp_path: Path) -> None:
+    output = tmp_path / 'result.json'
+    args = ['--depth', '1', '--fanout', '2', '--files', '2', '--autosummary', '--repeat', '1']
+    assert main([*args, '--workdir', str(tmp_path), '-o', str(output)]) == 0
+
+    result = json.loads(output.read_text(encoding='utf8'))
+    assert result['total_files'] == 6
+    assert set(result['results']) == {'make_indexes', '_list_files', '_iter_dirs', 'autosummary'}
+    assert set(result['peak_memory']) == {'make_indexes', '_scan_tree'}
+
+
+def test_import_time() -> None:
+    result = import_times(repeat=2)
+    # Зависимости, нужные только для формирования содержания, не загружаются при импорте
+    heavy = {'natsort', 'concurrent.futures', 'ctypes', 'cProfile', 'tracemalloc'}
+    assert not heavy & result['modules'].keys()
+    # Граница задана относительно Sphinx, чтобы не зависеть от скорости машины
+    sphinx = import_times('sphinx.application', preload=[], repeat=2)
+    assert result['total'] < sphinx['total'] / 4
@@ -0,0 +1,256 @@
+import json
+import pstats
+import shutil
+import tracemalloc
+from io import StringIO
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+import pytest
+from conftest import PROJECT_DIR, ignore_generated
+from sphinx.application import Sphinx
+from sphinx.errors import ExtensionError
+
+import sphinx_autotoc
+from sphinx_autotoc import __version__
+from sphinx_autotoc.__main__ import main as cli_main
+from sphinx_autotoc._outdated import get_ancestor_pages
+from sphinx_autotoc._stats import IndexStats
+
+
+def make_app(
+    tmp_path: Path,
+    parallel: int = 0,
+    warning: Optional[StringIO] = None,
+    confoverrides: Optional[Dict[str, Any]] = None,
+) -> Sphinx:
+    srcdir = tmp_path / 'project'
+    if not srcdir.exists():
+        shutil.copytree(PROJECT_DIR, srcdir, ignore=ignore_generated)
+    return Sphinx(
+        str(srcdir),
+        str(srcdir),
+        str(tmp_path / 'build' / 'html'),
+        str(tmp_path / 'build' / 'doctrees'),
+        'html',
+        confoverrides={'extensions': ['sphinx_autotoc'], **(confoverrides or {})},
+        status=None,
+        warning=warning if warning is not None else StringIO(),
+        parallel=parallel,
+    )
+
+
+class TestParallelBuild:
+    def test_extension_metadata(self, tmp_path: Path) -> None:
+        app = make_app(tmp_path)
+        extension = app.extensions['sphinx_autotoc']
+        assert extension.version == __version__
+        assert extension.parallel_read_safe
+        assert extension.parallel_write_safe
+
+    @pytest.mark.parametrize('parallel', [0, 4])
+    def test_build(self, tmp_path: Path, parallel: int) -> None:
+        warning = StringIO()
+        app = make_app(tmp_path, parallel, warning)
+        app.build()
+
+        assert app.statuscode == 0
+        assert app.is_parallel_allowed('read')
+        assert app.is_parallel_allowed('write')
+        assert 'parallel' not in warning.getvalue()
+        outdir = tmp_path / 'build' / 'html'
+        for page in [
+            'autotoc.html',
+            'src/1. level1/autotoc.1. level1.html',
+            'src/1. level1/2. level2/autotoc.2. level2.html',
+            'src/1. level1/2. level2/3. level3/l3.1.html',
+        ]:
+            assert (outdir / page).is_file(), page
+
+
+def list_tree(path: Path) -> Set[Path]:
+    return {item.relative_to(path) for item in path.rglob('*')}
+
+
+class TestVirtualPages:
+    overrides = {'sphinx_autotoc_virtual_pages': True}
+
+    def test_build_does_not_write_to_srcdir(self, tmp_path: Path) -> None:
+        app = make_app(tmp_path, confoverrides=self.overrides)
+        srcdir = Path(app.srcdir)
+        before = list_tree(srcdir)
+        app.build()
+
+        assert app.statuscode == 0
+        assert list_tree(srcdir) == before
+        outdir = tmp_path / 'build' / 'html'
+        assert (outdir / 'autotoc.html').is_file()
+        page = (outdir / 'src' / '1. level1' / 'autotoc.1. level1.html').read_text(encoding='utf8')
+        assert '2.%20level2/autotoc.2.%20level2.html' in page
+        assert '_sources' not in page
+
+    def test_parallel_build(self, tmp_path: Path) -> None:
+        app = make_app(tmp_path, parallel=4, confoverrides=self.overrides)
+        app.build()
+
+        assert app.statuscode == 0
+        assert (
+            tmp_path / 'build' / 'html' / 'src' / '1. level1' / 'autotoc.1. level1.html'
+        ).is_file()
+
+    def test_new_document_is_added_to_virtual_page(self, tmp_path: Path) -> None:
+        make_app(tmp_path, confoverrides=self.overrides).build()
+        (tmp_path / 'project' / 'src' / '1. level1' / 'l1.2.rst').write_text(
+            'l1.2\n====\n', encoding='utf8'
+        )
+        app = make_app(tmp_path, confoverrides=self.overrides)
+        app.build()
+
+        assert app.statuscode == 0
+        page = tmp_path / 'build' / 'html' / 'src' / '1. level1' / 'autotoc.1. level1.html'
+        assert 'l1.2.html' in page.read_text(encoding='utf8')
+
+
+class TestOutdatedPages:
+    @pytest.mark.parametrize('virtual_pages', [False, True])
+    def test_only_changed_pages_are_reread(self, tmp_path: Path, virtual_pages: bool) -> None:
+        overrides = {'sphinx_autotoc_virtual_pages': virtual_pages}
+        make_app(tmp_path, confoverrides=overrides).build()
+        level2 = tmp_path / 'project' / 'src' / '1. level1' / '2. level2'
+        (level2 / 'l2.3.rst').write_text('l2.3\n====\n', encoding='utf8')
+
+        app = make_app(tmp_path, confoverrides=overrides)
+        read: List[str] = []
+        app.connect('env-before-read-docs', lambda app, env, docnames: read.extend(docnames))
+        updated: List[str] = []
+        app.connect('env-updated', lambda app, env: updated.extend(get_ancestor_pages(app, env)))
+        app.build()
+
+        assert app.statuscode == 0
+        assert sorted(read) == [
+            'src/1. level1/2. level2/autotoc.2. level2',
+            'src/1. level1/2. level2/l2.3',
+        ]
+        assert updated == ['autotoc', 'src/1. level1/autotoc.1. level1']
+
+    @pytest.mark.parametrize('virtual_pages', [False, True])
+    def test_included_readme_change_rereads_its_page(
+        self, tmp_path: Path, virtual_pages: bool
+    ) -> None:
+        overrides = {
+            'sphinx_autotoc_readme_mode': 'include',
+            'sphinx_autotoc_virtual_pages': virtual_pages,
+            # README.md не должен читаться как отдельный документ
+            'source_suffix': {'.rst': 'restructuredtext'},
+        }
+        readme = tmp_path / 'project' / 'src' / '1. level1' / 'README.md'
+        app = make_app(tmp_path, confoverrides=overrides)
+        readme.write_text('first readme', encoding='utf8')
+        app.build()
+        readme.write_text('second readme', encoding='utf8')
+
+        app = make_app(tmp_path, confoverrides=overrides)
+        read: List[str] = []
+        app.connect('env-before-read-docs', lambda app, env, docnames: read.extend(docnames))
+        app.build()
+
+        assert app.statuscode == 0
+        assert read == ['src/1. level1/autotoc.1. level1']
+        html = tmp_path / 'build' / 'html' / 'src' / '1. level1' / 'autotoc.1. level1.html'
+        assert 'second readme' in html.read_text(encoding='utf8')
+
+    def test_unchanged_tree_rereads_nothing(self, tmp_path: Path) -> None:
+        make_app(tmp_path).build()
+        app = make_app(tmp_path)
+        read: List[str] = []
+        app.connect('env-before-read-docs', lambda app, env, docnames: read.extend(docnames))
+        app.build()
+
+        assert read == []
+        assert get_ancestor_pages(app, app.env) == []
+
+
+class TestProfile:
+    def test_cpu_profile(self, tmp_path: Path) -> None:
+        make_app(tmp_path, confoverrides={'sphinx_autotoc_profile': 'cpu'})
+        stats = pstats.Stats(str(tmp_path / 'build' / 'html' / 'sphinx_autotoc.prof'))
+        assert any(name == 'make_indexes' for _, _, name in stats.stats)  # type: ignore[attr-defined]
+
+    def test_memory_report(self, tmp_path: Path) -> None:
+        make_app(tmp_path, confoverrides={'sphinx_autotoc_profile': 'memory'})
+        report = (tmp_path / 'build' / 'html' / 'sphinx_autotoc.memory.txt').read_text()
+        assert report.startswith('Peak traced memory: ')
+        assert 'Top 25 lines' in report
+        assert not tracemalloc.is_tracing()
+
+    def test_unknown_mode(self, tmp_path: Path) -> None:
+        with pytest.raises(ExtensionError, match='sphinx_autotoc_profile'):
+            make_app(tmp_path, confoverrides={'sphinx_autotoc_profile': 'time'})
+
+
+class TestPregenerated:
+    overrides = {'sphinx_autotoc_pregenerated': True}
+
+    def count_runs(self, monkeypatch: pytest.MonkeyPatch) -> List[Path]:
+        runs: List[Path] = []
+        make_indexes = sphinx_autotoc.make_indexes
+
+        def counting_make_indexes(docs_directory: Path, *args: Any, **kwargs: Any) -> Any:
+            runs.append(docs_directory)
+            return make_indexes(docs_directory, *args, **kwargs)
+
+        monkeypatch.setattr(sphinx_autotoc, 'make_indexes', counting_make_indexes)
+        return runs
+
+    def test_pregenerated_pages_are_used(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        make_app(tmp_path, confoverrides=self.overrides)
+        runs = self.count_runs(monkeypatch)
+        assert cli_main([str(tmp_path / 'project')]) == 0
+        runs.clear()
+
+        app = make_app(tmp_path, confoverrides=self.overrides)
+        app.build()
+        assert app.statuscode == 0
+        assert runs == []
+        assert (tmp_path / 'build' / 'html' / 'autotoc.html').is_file()
+
+    def test_modified_pages_are_regenerated(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        make_app(tmp_path, confoverrides=self.overrides)
+        assert cli_main([str(tmp_path / 'project')]) == 0
+        (tmp_path / 'project' / 'autotoc.rst').write_text('edited\n', encoding='utf8')
+        runs = self.count_runs(monkeypatch)
+
+        make_app(tmp_path, confoverrides=self.overrides)
+        assert runs == [tmp_path / 'project']
+
+    def test_other_config_is_regenerated(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        make_app(tmp_path, confoverrides=self.overrides)
+        assert cli_main([str(tmp_path / 'project')]) == 0
+        runs = self.count_runs(monkeypatch)
+
+        overrides = {**self.overrides, 'sphinx_autotoc_header': 'Other'}
+        make_app(tmp_path, confoverrides=overrides)
+        assert runs == [tmp_path / 'project']
+        content = (tmp_path / 'project' / 'autotoc.rst').read_text(encoding='utf8')
+        assert ':caption: Other' in content
+
+
+class TestStats:
+    def test_stats_event_and_file(self, tmp_path: Path) -> None:
+        app = make_app(tmp_path, confoverrides={'sphinx_autotoc_stats_file': 'autotoc.json'})
+        # Событие испускается при инициализации сборщика, поэтому проверяем его повторным запуском
+        received: List[IndexStats] = []
+        app.connect('autotoc-stats', lambda app, stats: received.append(stats))
+        app.emit('builder-inited')
+
+        assert len(received) == 1
+        assert received[0].directories == 4
+        data = json.loads((tmp_path / 'build' / 'html' / 'autotoc.json').read_text())
+        assert data['directories'] == 4
+        assert set(data) >= {'timings', 'files', 'files_written', 'files_skipped', 'total'}
@@ -0,0 +1,82 @@
+from pathlib import Path
+
+import pytest
+
+from sphinx_autotoc import PREGENERATED_CACHE_DIR
+from sphinx_autotoc.__main__ import main
+
+LEVEL2 = Path('src', '1. level1', '2. level2')
+
+
+class TestCli:
+    def test_generate(self, project_path: Path) -> None:
+        assert main([str(project_path)]) == 0
+        assert (project_path / 'autotoc.rst').is_file()
+        assert (project_path / LEVEL2 / 'autotoc.2. level2.rst').is_file()
+        assert (project_path / PREGENERATED_CACHE_DIR / 'sphinx_autotoc.pickle').is_file()
+
+    def test_conf_py_options(self, project_path: Path) -> None:
+        with open(project_path / 'conf.py', 'a', encoding='utf8') as f:
+            f.write(
+                "sphinx_autotoc_header = 'MyHeader'\nsphinx_autotoc_trim_folder_numbers = True\n"
+            )
+        assert main([str(project_path)]) == 0
+        content = (project_path / 'autotoc.rst').read_text(encoding='utf8')
+        assert ':caption: MyHeader' in content
+        assert ':caption: Содержание' not in content
+        level2_page = project_path / LEVEL2 / 'autotoc.2. level2.rst'
+        assert level2_page.read_text(encoding='utf8').startswith('\nlevel2\n')
+
+    def test_dry_run_writes_nothing(
+        self, project_path: Path, capsys: pytest.CaptureFixture[str]
+    ) -> None:
+        assert main([str(project_path), '--dry-run']) == 0
+        assert not (project_path / 'autotoc.rst').exists()
+        assert 'write autotoc.rst\n' in capsys.readouterr().out
+
+    def test_check(self, project_path: Path, capsys: pytest.CaptureFixture[str]) -> None:
+        assert main([str(project_path), '--check']) == 1
+        main([str(project_path)])
+        capsys.readouterr()
+        assert main([str(project_path), '--check']) == 0
+        assert capsys.readouterr().out == ''
+
+        (project_path / LEVEL2 / 'l2.3.rst').touch()
+        assert main([str(project_path), '--check']) == 1
+        assert capsys.readouterr().out == 'write src/1. level1/2. level2/autotoc.2. level2.rst\n'
+
+    def test_check_reports_stale_pages(
+        self, project_path: Path, capsys: pytest.CaptureFixture[str]
+    ) -> None:
+        level3 = project_path / LEVEL2 / '3. level3'
+        main([str(project_path)])
+        for file in level3.iterdir():
+            if not file.name.startswith('autotoc.'):
+                file.unlink()
+        capsys.readouterr()
+
+        assert main([str(project_path), '--check']) == 1
+        assert 'remove src/1. level1/2. level2/3. level3/autotoc.3. level3.rst\n' in (
+            capsys.readouterr().out
+        )
+
+    def test_dry_run_matches_run_on_crlf_pages(
+        self, project_path: Path, capsys: pytest.CaptureFixture[str]
+    ) -> None:
+        level3 = project_path / LEVEL2 / '3. level3'
+        page = level3 / 'autotoc.3. level3.rst'
+        main([str(project_path)])
+        # Рабочая копия с переводами строк CRLF
+        page.write_bytes(page.read_bytes().replace(b'\n', b'\r\n'))
+        (level3 / 'l3.1.rst').unlink()
+        capsys.readouterr()
+
+        assert main([str(project_path), '--dry-run']) == 0
+        assert f'remove {page.relative_to(project_path).as_posix()}\n' in capsys.readouterr().out
+        main([str(project_path)])
+        assert not page.exists()
+
+    def test_missing_src(self, tmp_path: Path, capsys: pytest.CaptureFixture[str]) -> None:
+        (tmp_path / 'conf.py').write_text("project = 'Empty'\n", encoding='utf8')
+        assert main([str(tmp_path)]) == 2
+        assert 'sphinx-autotoc:' in capsys.readouterr().err
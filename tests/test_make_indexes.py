@@ -1,31 +1,49 @@
+import ctypes
+import errno
 import os
+import shutil
+import subprocess
+import sys
+import time
 from pathlib import Path
 from textwrap import dedent
-from typing import Dict, List, Set, Union
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
 
 import pytest
+from conftest import PROJECTS_DIR, copy_project
 from sphinx.config import Config
-from sphinx.errors import ConfigError
+from sphinx.errors import ConfigError, ExtensionError
+from sphinx.util.matching import Matcher
 
-from sphinx_autotoc import _list_files, _make_search_paths, make_indexes, trim_leading_numbers
-
-MAKE_INDEXES_TEST_PROJECTS_DIR = os.path.join(
-    os.path.dirname(os.path.realpath(__file__)), 'make_indexes_test_projects'
+import sphinx_autotoc
+from sphinx_autotoc import (
+    CONFIG_VALUES,
+    DirNode,
+    _iter_dirs,
+    _list_files,
+    _make_search_paths,
+    _scan_tree,
+    make_indexes,
+    trim_leading_numbers,
 )
+from sphinx_autotoc._exclude import ExcludeMatcher
+from sphinx_autotoc._git import git_files
+from sphinx_autotoc._snapshot import DirRecord
+from sphinx_autotoc._stats import IndexStats
+from sphinx_autotoc._watch import InotifyBackend, TreeWatcher, get_watcher
 
 
 def activate_cfg(path: Path) -> Config:
     cfg = Config.read(str(path))
     cfg.pre_init_values()
     cfg.init_values()
-    cfg.add('sphinx_autotoc_trim_folder_numbers', False, 'html', bool)
-    cfg.add('sphinx_autotoc_get_headers_from_subfolder', False, 'html', bool)
-    cfg.add('sphinx_autotoc_header', 'Содержание', 'html', str)
+    for name, default, rebuild, types in CONFIG_VALUES:
+        cfg.add(name, default, rebuild, types)
     return cfg
 
 
 def test_make_indexes_wrong_directory() -> None:
-    path = Path(MAKE_INDEXES_TEST_PROJECTS_DIR) / 'doesnotexist'
+    path = PROJECTS_DIR / 'doesnotexist'
     with pytest.raises(ConfigError):
         cfg = activate_cfg(path)
         make_indexes(path, cfg)
@@ -52,14 +70,12 @@ class TestTrimLeadingNumbers:
 
 
 class TestMakeIndexesFlags:
-    project_path = Path(MAKE_INDEXES_TEST_PROJECTS_DIR, '3_levels_of_nesting')
-
-    def test_make_indexes_default_flags(self) -> None:
-        cfg = activate_cfg(self.project_path)
+    def test_make_indexes_default_flags(self, project_path: Path) -> None:
+        cfg = activate_cfg(project_path)
 
-        make_indexes(self.project_path, cfg)
-        assert os.path.isfile(self.project_path / 'autotoc.rst')
-        with open(self.project_path / 'autotoc.rst', encoding='utf8') as f:
+        make_indexes(project_path, cfg)
+        assert os.path.isfile(project_path / 'autotoc.rst')
+        with open(project_path / 'autotoc.rst', encoding='utf8') as f:
             assert f.read() == dedent("""
             3 levels of nesting Test Project
             ====================================================
@@ -70,14 +86,14 @@ class TestMakeIndexesFlags:
                src/1. level1/autotoc.1. level1.rst
             """)
 
-    def test_make_indexes_sf(self) -> None:
-        cfg = activate_cfg(self.project_path)
+    def test_make_indexes_sf(self, project_path: Path) -> None:
+        cfg = activate_cfg(project_path)
 
         cfg['sphinx_autotoc_get_headers_from_subfolder'] = True
 
-        make_indexes(self.project_path, cfg)
-        assert os.path.isfile(self.project_path / 'autotoc.rst')
-        with open(self.project_path / 'autotoc.rst', encoding='utf8') as f:
+        make_indexes(project_path, cfg)
+        assert os.path.isfile(project_path / 'autotoc.rst')
+        with open(project_path / 'autotoc.rst', encoding='utf8') as f:
             assert f.read() == dedent("""
             3 levels of nesting Test Project
             ====================================================
@@ -90,13 +106,13 @@ class TestMakeIndexesFlags:
                src/1. level1/l1.1.rst
             """)
 
-    def test_make_indexes_trim(self) -> None:
-        cfg = activate_cfg(self.project_path)
+    def test_make_indexes_trim(self, project_path: Path) -> None:
+        cfg = activate_cfg(project_path)
 
         cfg['sphinx_autotoc_trim_folder_numbers'] = True
 
-        make_indexes(self.project_path, cfg)
-        rst = self.project_path / 'src' / '1. level1' / 'autotoc.1. level1.rst'
+        make_indexes(project_path, cfg)
+        rst = project_path / 'src' / '1. level1' / 'autotoc.1. level1.rst'
         assert rst.is_file()
         with open(rst, encoding='utf8') as f:
             assert f.read() == dedent("""
@@ -112,15 +128,15 @@ class TestMakeIndexesFlags:
                l1.1.rst
             """)
 
-    def test_make_indexes_sf_trim(self) -> None:
-        cfg = activate_cfg(self.project_path)
+    def test_make_indexes_sf_trim(self, project_path: Path) -> None:
+        cfg = activate_cfg(project_path)
 
         cfg['sphinx_autotoc_get_headers_from_subfolder'] = True
         cfg['sphinx_autotoc_trim_folder_numbers'] = True
 
-        make_indexes(self.project_path, cfg)
-        assert os.path.isfile(self.project_path / 'autotoc.rst')
-        with open(self.project_path / 'autotoc.rst', encoding='utf8') as f:
+        make_indexes(project_path, cfg)
+        assert os.path.isfile(project_path / 'autotoc.rst')
+        with open(project_path / 'autotoc.rst', encoding='utf8') as f:
             assert f.read() == dedent("""
             3 levels of nesting Test Project
             ====================================================
@@ -133,13 +149,13 @@ class TestMakeIndexesFlags:
                src/1. level1/l1.1.rst
                """)
 
-    def test_make_indexes_custom_header(self) -> None:
-        cfg = activate_cfg(self.project_path)
+    def test_make_indexes_custom_header(self, project_path: Path) -> None:
+        cfg = activate_cfg(project_path)
 
         cfg['sphinx_autotoc_header'] = 'custom header'
-        make_indexes(self.project_path, cfg)
-        assert os.path.isfile(self.project_path / 'autotoc.rst')
-        with open(self.project_path / 'autotoc.rst', encoding='utf8') as f:
+        make_indexes(project_path, cfg)
+        assert os.path.isfile(project_path / 'autotoc.rst')
+        with open(project_path / 'autotoc.rst', encoding='utf8') as f:
             assert f.read() == dedent("""
             3 levels of nesting Test Project
             ====================================================
@@ -152,88 +168,744 @@ class TestMakeIndexesFlags:
 
 
 class TestAutosummaryCompatibility:
-    project_path = Path(MAKE_INDEXES_TEST_PROJECTS_DIR, 'autosummary_test')
+    @pytest.fixture
+    def project_path(self, tmp_path: Path) -> Path:
+        return copy_project('autosummary_test', tmp_path)
 
     @pytest.mark.parametrize(
         'test_file_path, test_file_line',
         [
-            (project_path / 'autotoc.rst', '   L1header <src/1. level1/_autosummary/Level1>\n'),
-            (
-                project_path / 'src/1. level1/autotoc.1. level1.rst',
-                '   L1header <_autosummary/Level1>\n',
-            ),
+            ('autotoc.rst', '   L1header <src/1. level1/_autosummary/Level1>\n'),
+            ('src/1. level1/autotoc.1. level1.rst', '   L1header <_autosummary/Level1>\n'),
             (
-                project_path / 'src/1. level1/2. level2/autotoc.2. level2.rst',
+                'src/1. level1/2. level2/autotoc.2. level2.rst',
                 '   l2header <_autosummary/Level2>\n',
             ),
             (
-                project_path / 'src/1. level1/2. level2/3. level3/autotoc.3. level3.rst',
+                'src/1. level1/2. level2/3. level3/autotoc.3. level3.rst',
                 '   l3 <_autosummary/Level3>\n',
             ),
         ],
     )
-    def test_autosummary_in_several_levels(self, test_file_path: Path, test_file_line: str) -> None:
-        cfg = activate_cfg(self.project_path)
+    def test_autosummary_in_several_levels(
+        self, project_path: Path, test_file_path: str, test_file_line: str
+    ) -> None:
+        cfg = activate_cfg(project_path)
         cfg.add('autosummary_generate', True, 'html', bool)
         cfg['sphinx_autotoc_get_headers_from_subfolder'] = True
-        make_indexes(self.project_path, cfg)
-        assert os.path.isfile(test_file_path)
-        with open(test_file_path) as f:
+        make_indexes(project_path, cfg)
+        assert os.path.isfile(project_path / test_file_path)
+        with open(project_path / test_file_path) as f:
             lines = f.readlines()
             assert test_file_line in lines
 
 
-def prepare_search_paths(root: Path, file_list: List[str], folder_list: List[str]) -> List[Path]:
-    for folder in folder_list:
-        (root / folder).mkdir()
+class TestWriteIfChanged:
+    def test_unchanged_files_are_not_rewritten(self, tmp_path: Path) -> None:
+        project_path = copy_project('3_levels_of_nesting', tmp_path)
+        cfg = activate_cfg(project_path)
+        make_indexes(project_path, cfg)
+        generated = list(project_path.rglob('autotoc*.rst'))
+        mtimes = {path: path.stat().st_mtime_ns for path in generated}
 
-    for file in file_list:
-        (root / file).touch()
+        make_indexes(project_path, cfg)
+        assert {path: path.stat().st_mtime_ns for path in generated} == mtimes
+
+    def test_changed_files_are_rewritten(self, tmp_path: Path) -> None:
+        project_path = copy_project('3_levels_of_nesting', tmp_path)
+        cfg = activate_cfg(project_path)
+        make_indexes(project_path, cfg)
+
+        (project_path / 'src' / '1. level1' / 'l1.2.rst').touch()
+        make_indexes(project_path, cfg)
+        with open(project_path / 'src' / '1. level1' / 'autotoc.1. level1.rst') as f:
+            assert '   l1.2.rst\n' in f.readlines()
+
+
+class TestWorkers:
+    def test_parallel_output_matches_serial(self, tmp_path: Path) -> None:
+        results = []
+        for workers in [1, 4]:
+            project_path = copy_project('autosummary_test', tmp_path / str(workers))
+            for i in range(20):
+                folder = project_path / 'src' / '1. level1' / f'{i}. generated'
+                folder.mkdir()
+                (folder / f'{i}.rst').touch()
+            cfg = activate_cfg(project_path)
+            cfg.add('autosummary_generate', True, 'html', bool)
+            cfg['sphinx_autotoc_workers'] = workers
+            pages = make_indexes(project_path, cfg)
+            results.append({
+                path.relative_to(project_path): content for path, content in pages.items()
+            })
+            for path, content in pages.items():
+                assert path.read_text(encoding='utf8') == content
+
+        assert list(results[0].items()) == list(results[1].items())
+
+
+class TestStats:
+    def test_counters_and_phases(self, tmp_path: Path) -> None:
+        project_path = copy_project('autosummary_test', tmp_path)
+        cfg = activate_cfg(project_path)
+        cfg.add('autosummary_generate', True, 'html', bool)
+        stats = IndexStats()
+        pages = make_indexes(project_path, cfg, stats=stats)
+
+        assert stats.directories == 4
+        assert stats.files == 3
+        assert stats.files_written == len(pages)
+        assert stats.files_skipped == 0
+        assert stats.bytes_written == sum(len(content.encode('utf8')) for content in pages.values())
+        for phase in ['walk', 'grouping', 'sorting', 'rendering', 'writing', 'autosummary']:
+            assert stats.timings[phase] >= 0
+        assert 'written' in stats.summary()
+
+        stats = IndexStats()
+        make_indexes(project_path, cfg, stats=stats)
+        assert stats.files_written == 0
+        assert stats.files_skipped == len(pages)
+        assert stats.bytes_written == 0
+
+
+class TestShards:
+    def make_big_folder(self, tmp_path: Path, names: List[str]) -> Path:
+        project_path = copy_project('3_levels_of_nesting', tmp_path)
+        big = project_path / 'src' / 'big'
+        (big / 'sub').mkdir(parents=True)
+        (big / 'sub' / 'page.rst').touch()
+        for name in names:
+            (big / f'{name}.rst').touch()
+        return project_path
+
+    def make_indexes_sharded(self, project_path: Path, size: int, mode: str) -> Dict[Path, str]:
+        cfg = activate_cfg(project_path)
+        cfg['sphinx_autotoc_shard_size'] = size
+        cfg['sphinx_autotoc_shard_mode'] = mode
+        return make_indexes(project_path, cfg)
+
+    def test_size_shards(self, tmp_path: Path) -> None:
+        project_path = self.make_big_folder(tmp_path, [f'page{i}' for i in range(25)])
+        big = project_path / 'src' / 'big'
+        pages = self.make_indexes_sharded(project_path, 10, 'size')
+
+        shards = [big / f'autotoc.big.part-0{i}.rst' for i in range(1, 4)]
+        assert [path for path in pages if path.parent == big] == [big / 'autotoc.big.rst', *shards]
+        assert pages[big / 'autotoc.big.rst'].rstrip().split('\n')[-4:] == [
+            '   sub/autotoc.sub.rst',
+            '   autotoc.big.part-01.rst',
+            '   autotoc.big.part-02.rst',
+            '   autotoc.big.part-03.rst',
+        ]
+        assert pages[shards[0]].startswith('\npage0 – page9\n')
+        assert [pages[shard].count('\n   page') for shard in shards] == [10, 10, 5]
+
+        # Записанные части не попадают в содержание при следующей сборке
+        assert self.make_indexes_sharded(project_path, 10, 'size') == pages
+
+    def test_alpha_shards(self, tmp_path: Path) -> None:
+        names = [f'a{i}' for i in range(5)] + [f'b{i}' for i in range(3)]
+        names += [f'c{i:02}' for i in range(12)]
+        project_path = self.make_big_folder(tmp_path, names)
+        big = project_path / 'src' / 'big'
+        pages = self.make_indexes_sharded(project_path, 10, 'alpha')
+
+        titles = [
+            content.split('\n')[1] for path, content in pages.items() if '.part-' in path.name
+        ]
+        assert titles == ['A – B', 'C', 'C']
+        assert pages[big / 'autotoc.big.part-01.rst'].count('.rst') == 8
+
+    def test_alpha_shards_ignore_case(self, tmp_path: Path) -> None:
+        project_path = self.make_big_folder(tmp_path, ['A1', 'B1', 'C1', 'a2', 'b2', 'c2'])
+        big = project_path / 'src' / 'big'
+        pages = self.make_indexes_sharded(project_path, 4, 'alpha')
+
+        titles = [
+            content.split('\n')[1] for path, content in pages.items() if '.part-' in path.name
+        ]
+        assert titles == ['A – B', 'C']
+        first = pages[big / 'autotoc.big.part-01.rst']
+        assert first.index('A1.rst') < first.index('a2.rst') < first.index('B1.rst')
+
+    def test_small_folder_is_not_sharded(self, tmp_path: Path) -> None:
+        project_path = self.make_big_folder(tmp_path, [f'page{i}' for i in range(10)])
+        pages = self.make_indexes_sharded(project_path, 10, 'size')
+        assert not any('.part-' in path.name for path in pages)
+
+    def test_unknown_mode(self, tmp_path: Path) -> None:
+        project_path = self.make_big_folder(tmp_path, [])
+        with pytest.raises(ExtensionError):
+            self.make_indexes_sharded(project_path, 10, 'random')
+
+
+class TestTocOptions:
+    level1 = Path('src', '1. level1', 'autotoc.1. level1.rst')
+    level2 = Path('src', '1. level1', '2. level2', 'autotoc.2. level2.rst')
+    level3 = Path('src', '1. level1', '2. level2', '3. level3', 'autotoc.3. level3.rst')
+
+    def make_indexes_with(self, tmp_path: Path, **options: Any) -> Dict[Path, str]:
+        project_path = copy_project('3_levels_of_nesting', tmp_path)
+        cfg = activate_cfg(project_path)
+        for name, value in options.items():
+            cfg[f'sphinx_autotoc_{name}'] = value
+        pages = make_indexes(project_path, cfg)
+        return {path.relative_to(project_path): content for path, content in pages.items()}
+
+    def test_global_maxdepth_and_titlesonly(self, tmp_path: Path) -> None:
+        pages = self.make_indexes_with(tmp_path, maxdepth=3, titlesonly=True)
+        for content in pages.values():
+            assert ':maxdepth: 3\n   :titlesonly:\n' in content
+
+    def test_level_and_dir_overrides(self, tmp_path: Path) -> None:
+        pages = self.make_indexes_with(
+            tmp_path, level_maxdepth={0: 1, 1: 3}, dir_maxdepth={'src/1. level1/2. level2/': 4}
+        )
+        assert ':maxdepth: 1\n' in pages[Path('autotoc.rst')]
+        assert ':maxdepth: 3\n' in pages[self.level1]
+        assert ':maxdepth: 4\n' in pages[self.level2]
+        assert ':maxdepth: 2\n' in pages[self.level3]
+
+    def test_budget_lowers_depth(self, tmp_path: Path) -> None:
+        pages = self.make_indexes_with(tmp_path, toctree_budget=4)
+        # level1 на глубине 2: level2, l1, l1.1 и три ссылки из level2
+        assert ':maxdepth: 1\n' in pages[self.level1]
+        assert ':maxdepth: 2\n' in pages[self.level2]
+        assert ':maxdepth: 2\n' in pages[Path('autotoc.rst')]
+
+    def test_budget_keeps_unlimited_depth_that_fits(self, tmp_path: Path) -> None:
+        pages = self.make_indexes_with(tmp_path, maxdepth=-1, toctree_budget=100)
+        assert ':maxdepth: -1\n' in pages[self.level1]
+
+
+class TestRoots:
+    @pytest.fixture
+    def project_path(self, tmp_path: Path) -> Path:
+        project_path = copy_project('3_levels_of_nesting', tmp_path)
+        component = project_path / 'components' / 'api' / '1. first'
+        component.mkdir(parents=True)
+        (component / 'a.rst').touch()
+        (component.parent / 'b.rst').touch()
+        return project_path
+
+    def make_indexes_with_roots(
+        self, project_path: Path, cache_dir: Optional[Path] = None, **options: Any
+    ) -> Dict[Path, str]:
+        cfg = activate_cfg(project_path)
+        cfg['sphinx_autotoc_roots'] = [
+            'src',
+            {'path': 'components/api', 'caption': 'API', 'trim_folder_numbers': True},
+        ]
+        for name, value in options.items():
+            cfg[f'sphinx_autotoc_{name}'] = value
+        pages = make_indexes(project_path, cfg, cache_dir)
+        return {path.relative_to(project_path): content for path, content in pages.items()}
+
+    def test_roots_on_main_page(self, project_path: Path) -> None:
+        pages = self.make_indexes_with_roots(project_path)
+        main_page = pages[Path('autotoc.rst')]
+        assert main_page.index(':caption: Содержание') < main_page.index(':caption: API')
+        assert '   components/api/1. first/autotoc.1. first.rst\n' in main_page
+        assert '   components/api/b.rst\n' in main_page
+        first = pages[Path('components', 'api', '1. first', 'autotoc.1. first.rst')]
+        assert first.startswith('\nfirst\n')
+        assert '   src/1. level1/autotoc.1. level1.rst\n' in main_page
+
+    def test_processes_match_serial(self, project_path: Path) -> None:
+        serial = self.make_indexes_with_roots(project_path)
+        assert self.make_indexes_with_roots(project_path, processes=2) == serial
+
+    @pytest.mark.parametrize('processes', [0, 2])
+    def test_changed_root_with_cache(self, project_path: Path, processes: int) -> None:
+        cache_dir = project_path / '_cache'
+        self.make_indexes_with_roots(project_path, cache_dir, processes=processes)
+        age_directories(project_path / 'src')
+        age_directories(project_path / 'components')
+        self.make_indexes_with_roots(project_path, cache_dir, processes=processes)
+        assert self.make_indexes_with_roots(project_path, cache_dir, processes=processes) == {}
+        (project_path / 'components' / 'api' / 'c.rst').touch()
+        pages = self.make_indexes_with_roots(project_path, cache_dir, processes=processes)
+        assert '   components/api/c.rst\n' in pages[Path('autotoc.rst')]
+        assert pages == self.make_indexes_with_roots(project_path)
+
+    def test_root_level_depth(self, project_path: Path) -> None:
+        pages = self.make_indexes_with_roots(project_path, level_maxdepth={1: 5})
+        assert (
+            ':maxdepth: 5\n' in pages[Path('components', 'api', '1. first', 'autotoc.1. first.rst')]
+        )
+        assert ':maxdepth: 5\n' in pages[Path('src', '1. level1', 'autotoc.1. level1.rst')]
+
+    @pytest.mark.parametrize(
+        'roots',
+        [
+            ['src', 'src/1. level1'],
+            [{'caption': 'No path'}],
+            [{'path': 'src', 'x': 1}],
+            ['.'],
+            [''],
+            ['./'],
+            ['../src'],
+            ['/src'],
+        ],
+    )
+    def test_invalid_roots(self, project_path: Path, roots: List[Any]) -> None:
+        cfg = activate_cfg(project_path)
+        cfg['sphinx_autotoc_roots'] = roots
+        with pytest.raises(ExtensionError, match='sphinx_autotoc_roots'):
+            make_indexes(project_path, cfg)
+
+
+class TestAutosummarySinglePass:
+    def test_similar_file_names_are_not_replaced(self, tmp_path: Path) -> None:
+        project_path = copy_project('autosummary_test', tmp_path)
+        level1 = project_path / 'src' / '1. level1'
+        (level1 / 'my_autotoc.autosummary.rst').write_text('Other\n=====\n', encoding='utf8')
+        cfg = activate_cfg(project_path)
+        cfg.add('autosummary_generate', True, 'html', bool)
+        make_indexes(project_path, cfg)
+
+        with open(level1 / 'autotoc.1. level1.rst', encoding='utf8') as f:
+            lines = f.readlines()
+        assert '   L1header <_autosummary/Level1>\n' in lines
+        assert '   my_autotoc.autosummary.rst\n' in lines
+
+    def test_autosummary_in_src(self, tmp_path: Path) -> None:
+        project_path = copy_project('autosummary_test', tmp_path)
+        shutil.copy(
+            project_path / 'src' / '1. level1' / 'autotoc.autosummary.rst', project_path / 'src'
+        )
+        cfg = activate_cfg(project_path)
+        cfg.add('autosummary_generate', True, 'html', bool)
+        make_indexes(project_path, cfg)
+
+        with open(project_path / 'autotoc.rst', encoding='utf8') as f:
+            assert '   L1header <src/_autosummary/Level1>\n' in f.readlines()
+
+    def test_custom_pattern(self, tmp_path: Path) -> None:
+        project_path = copy_project('autosummary_test', tmp_path)
+        level1 = project_path / 'src' / '1. level1'
+        (level1 / 'autotoc.autosummary.rst').rename(level1 / 'level1.api.rst')
+        cfg = activate_cfg(project_path)
+        cfg.add('autosummary_generate', True, 'html', bool)
+        cfg['sphinx_autotoc_autosummary_pattern'] = '*.api.rst'
+        make_indexes(project_path, cfg)
+
+        with open(level1 / 'autotoc.1. level1.rst', encoding='utf8') as f:
+            assert '   L1header <_autosummary/Level1>\n' in f.readlines()
+
+    def test_unchanged_files_are_not_parsed(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        project_path = copy_project('autosummary_test', tmp_path)
+        cfg = activate_cfg(project_path)
+        cfg.add('autosummary_generate', True, 'html', bool)
+        make_indexes(project_path, cfg, project_path / '_build')
+
+        parsed: List[Path] = []
+        parse = sphinx_autotoc._parse_autosummary
+
+        def counting_parse(file: Path) -> Optional[Tuple[str, str]]:
+            parsed.append(file)
+            return parse(file)
+
+        monkeypatch.setattr(sphinx_autotoc, '_parse_autosummary', counting_parse)
+        level1 = project_path / 'src' / '1. level1'
+        (level1 / 'l1.2.rst').touch()
+        with open(level1 / 'autotoc.autosummary.rst', 'a', encoding='utf8') as f:
+            f.write('\n')
+        make_indexes(project_path, cfg, project_path / '_build')
+
+        assert parsed == [level1 / 'autotoc.autosummary.rst']
+        level3 = level1 / '2. level2' / '3. level3'
+        with open(level3 / 'autotoc.3. level3.rst', encoding='utf8') as f:
+            assert '   l3 <_autosummary/Level3>\n' in f.readlines()
+
+    @pytest.mark.parametrize(
+        'content', ['', 'Header\n======\n', '.. autosummary::\n   :toctree:\n']
+    )
+    def test_parse_without_entries(self, tmp_path: Path, content: str) -> None:
+        file = tmp_path / 'autotoc.autosummary.rst'
+        file.write_text(content, encoding='utf8')
+        assert sphinx_autotoc._parse_autosummary(file) is None
+
+
+def age_directories(root: Path, seconds: int = 3600) -> None:
+    """Переносит время изменения папок в прошлое, чтобы снимок им доверял."""
+    timestamp = time.time() - seconds
+    for path in [root, *root.rglob('*')]:
+        if path.is_dir():
+            os.utime(path, (timestamp, timestamp))
+
+
+class TestSnapshot:
+    def make_indexes_cached(self, project_path: Path) -> None:
+        make_indexes(project_path, activate_cfg(project_path), project_path / '_build')
+
+    def test_unchanged_tree_is_not_rescanned(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        project_path = copy_project('3_levels_of_nesting', tmp_path)
+        self.make_indexes_cached(project_path)
+        # Первая сборка создаёт сервисные файлы и тем самым меняет время изменения папок
+        age_directories(project_path / 'src')
+        self.make_indexes_cached(project_path)
+        assert (project_path / '_build' / 'sphinx_autotoc.pickle').is_file()
+
+        scanned: List[str] = []
+        scandir = os.scandir
+
+        def counting_scandir(path: str) -> 'os._ScandirIterator[str]':
+            scanned.append(path)
+            return scandir(path)
+
+        monkeypatch.setattr(os, 'scandir', counting_scandir)
+        self.make_indexes_cached(project_path)
+        assert scanned == []
+
+    def test_changed_directory_is_rescanned(self, tmp_path: Path) -> None:
+        project_path = copy_project('3_levels_of_nesting', tmp_path)
+        age_directories(project_path / 'src')
+        self.make_indexes_cached(project_path)
+
+        level2 = project_path / 'src' / '1. level1' / '2. level2'
+        (level2 / 'l2.3.rst').touch()
+        age_directories(level2, 1800)
+        self.make_indexes_cached(project_path)
+        with open(level2 / 'autotoc.2. level2.rst', encoding='utf8') as f:
+            assert '   l2.3.rst\n' in f.readlines()
+
+    def test_changed_readme_is_reread(self, tmp_path: Path) -> None:
+        project_path = copy_project('3_levels_of_nesting', tmp_path)
+        level1 = project_path / 'src' / '1. level1'
+        (level1 / 'README.md').write_text('first', encoding='utf8')
+        age_directories(project_path / 'src')
+        self.make_indexes_cached(project_path)
+
+        (level1 / 'README.md').write_text('second readme', encoding='utf8')
+        self.make_indexes_cached(project_path)
+        with open(level1 / 'autotoc.1. level1.rst', encoding='utf8') as f:
+            assert 'second readme' in f.read()
+
+    def test_included_readme_does_not_change_pages(self, tmp_path: Path) -> None:
+        project_path = copy_project('3_levels_of_nesting', tmp_path)
+        level1 = project_path / 'src' / '1. level1'
+        (level1 / 'README.md').write_text('first', encoding='utf8')
+        cfg = activate_cfg(project_path)
+        cfg['sphinx_autotoc_readme_mode'] = 'include'
+        pages = make_indexes(project_path, cfg, project_path / '_build')
+        age_directories(project_path / 'src')
+        make_indexes(project_path, cfg, project_path / '_build')
+        content = pages[level1 / 'autotoc.1. level1.rst']
+        assert '\n.. include:: /src/1. level1/README.md\n' in content
+        assert 'first' not in content
 
-    full_list = [Path(item) for item in file_list + folder_list]
-    return full_list
+        (level1 / 'README.md').write_text('second readme', encoding='utf8')
+        assert make_indexes(project_path, cfg, project_path / '_build') == {}
+
+    def test_unknown_readme_mode(self, tmp_path: Path) -> None:
+        project_path = copy_project('3_levels_of_nesting', tmp_path)
+        cfg = activate_cfg(project_path)
+        cfg['sphinx_autotoc_readme_mode'] = 'link'
+        with pytest.raises(ExtensionError, match='sphinx_autotoc_readme_mode'):
+            make_indexes(project_path, cfg)
+
+    def test_deleted_page_is_restored(self, tmp_path: Path) -> None:
+        project_path = copy_project('3_levels_of_nesting', tmp_path)
+        age_directories(project_path / 'src')
+        self.make_indexes_cached(project_path)
+
+        (project_path / 'autotoc.rst').unlink()
+        self.make_indexes_cached(project_path)
+        assert (project_path / 'autotoc.rst').is_file()
+
+
+class TestStalePages:
+    @pytest.fixture
+    def project_path(self, tmp_path: Path) -> Path:
+        project_path = copy_project('3_levels_of_nesting', tmp_path)
+        self.make_indexes_cached(project_path)
+        return project_path
+
+    def make_indexes_cached(self, project_path: Path, write: bool = True) -> Dict[Path, str]:
+        cfg = activate_cfg(project_path)
+        return make_indexes(project_path, cfg, project_path / '_build', write=write)
+
+    def test_page_of_emptied_folder_is_removed(self, project_path: Path) -> None:
+        level3 = project_path / 'src' / '1. level1' / '2. level2' / '3. level3'
+        (level3 / 'l3.1.rst').unlink()
+        self.make_indexes_cached(project_path)
+        assert list(level3.iterdir()) == []
+
+    def test_page_of_renamed_folder_is_removed(self, project_path: Path) -> None:
+        level2 = project_path / 'src' / '1. level1' / '2. level2'
+        (level2 / '3. level3').rename(level2 / 'renamed')
+        pages = self.make_indexes_cached(project_path)
+
+        assert sorted(path.name for path in (level2 / 'renamed').iterdir()) == [
+            'autotoc.renamed.rst',
+            'l3.1.rst',
+        ]
+        assert 'autotoc.3. level3' not in pages[level2 / 'renamed' / 'autotoc.renamed.rst']
+
+    def test_renamed_and_emptied_folder_is_dropped(self, project_path: Path) -> None:
+        level2 = project_path / 'src' / '1. level1' / '2. level2'
+        (level2 / '3. level3').rename(level2 / 'renamed')
+        (level2 / 'renamed' / 'l3.1.rst').unlink()
+        pages = self.make_indexes_cached(project_path)
+
+        assert list((level2 / 'renamed').iterdir()) == []
+        assert 'renamed' not in pages[level2 / 'autotoc.2. level2.rst']
+        assert pages == make_indexes(project_path, activate_cfg(project_path))
+
+    def test_modified_page_is_kept(self, project_path: Path) -> None:
+        level3 = project_path / 'src' / '1. level1' / '2. level2' / '3. level3'
+        (level3 / 'autotoc.3. level3.rst').write_text('Edited\n======\n', encoding='utf8')
+        (level3 / 'l3.1.rst').unlink()
+        self.make_indexes_cached(project_path)
+        assert (level3 / 'autotoc.3. level3.rst').is_file()
+
+    def test_pages_are_removed_when_not_written(self, project_path: Path) -> None:
+        stats = IndexStats()
+        cfg = activate_cfg(project_path)
+        cfg['sphinx_autotoc_virtual_pages'] = True
+        make_indexes(project_path, cfg, project_path / '_build', write=False, stats=stats)
+
+        assert stats.files_removed == 4
+        assert not (project_path / 'autotoc.rst').exists()
+
+
+def git(path: Path, *args: str) -> None:
+    subprocess.run(['git', '-C', str(path), *args], check=True, capture_output=True)
+
+
+@pytest.mark.skipif(shutil.which('git') is None, reason='git is not installed')
+class TestGitIndex:
+    @pytest.fixture
+    def project_path(self, tmp_path: Path) -> Path:
+        project_path = copy_project('3_levels_of_nesting', tmp_path)
+        (project_path / '.gitignore').write_text('_build/\nautotoc*.rst\n', encoding='utf8')
+        git(project_path, 'init', '-q')
+        git(project_path, 'add', '.')
+        return project_path
+
+    def make_indexes_git(
+        self, project_path: Path, stats: Optional[IndexStats] = None
+    ) -> Dict[Path, str]:
+        cfg = activate_cfg(project_path)
+        cfg['sphinx_autotoc_git_index'] = True
+        return make_indexes(project_path, cfg, project_path / '_build', stats=stats)
+
+    def test_git_files(self, project_path: Path) -> None:
+        level3 = 'src/1. level1/2. level2/3. level3'
+        (project_path / level3 / 'l3.1.rst').unlink()
+        (project_path / level3 / 'new.rst').touch()
+        (project_path / level3 / 'autotoc.3. level3.rst').touch()
+
+        files = git_files(project_path, ['src'])
+        assert files is not None
+        assert f'{level3}/new.rst' in files, 'Неотслеживаемые файлы должны попадать в список'
+        assert f'{level3}/l3.1.rst' not in files, 'Удалённые файлы не должны попадать в список'
+        assert not any('autotoc.' in file for file in files)
+
+    def test_unchanged_tree_is_not_walked(
+        self, project_path: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        pages = self.make_indexes_git(project_path)
+        # Как в только что созданной рабочей копии: сервисных файлов нет
+        for path in pages:
+            path.unlink()
+
+        def fail(*args: Any) -> None:
+            pytest.fail('Дерево не должно обходиться')
+
+        monkeypatch.setattr(sphinx_autotoc, '_scan_tree', fail)
+        stats = IndexStats()
+        assert self.make_indexes_git(project_path, stats) == pages
+        assert stats.files_written == len(pages)
+        for path, content in pages.items():
+            assert path.read_text(encoding='utf8') == content
+
+    def test_new_file_is_picked_up(self, project_path: Path) -> None:
+        self.make_indexes_git(project_path)
+        level2 = project_path / 'src' / '1. level1' / '2. level2'
+        (level2 / 'l2.3.rst').touch()
+        pages = self.make_indexes_git(project_path)
+        assert '   l2.3.rst\n' in pages[level2 / 'autotoc.2. level2.rst']
+
+    def test_changed_readme_is_reread(self, project_path: Path) -> None:
+        readme = project_path / 'src' / '1. level1' / 'README.md'
+        readme.write_text('first', encoding='utf8')
+        self.make_indexes_git(project_path)
+        readme.write_text('other', encoding='utf8')
+        pages = self.make_indexes_git(project_path)
+        assert 'other' in pages[readme.parent / 'autotoc.1. level1.rst']
+
+    def test_without_git_repository(self, tmp_path: Path) -> None:
+        project_path = copy_project('3_levels_of_nesting', tmp_path)
+        assert git_files(project_path, ['src']) is None
+        assert project_path / 'autotoc.rst' in self.make_indexes_git(project_path)
+
+
+class TestWatcher:
+    @pytest.fixture
+    def project_path(self, tmp_path: Path) -> Path:
+        return copy_project('3_levels_of_nesting', tmp_path)
+
+    @pytest.mark.parametrize('mode', ['inotify', 'poll'])
+    def test_structural_changes_are_picked_up(self, project_path: Path, mode: str) -> None:
+        if mode == 'inotify' and not sys.platform.startswith('linux'):
+            pytest.skip('inotify is only available on Linux')
+        cfg = activate_cfg(project_path)
+        watcher = TreeWatcher(project_path, mode)
+        try:
+            make_indexes(project_path, cfg, watcher=watcher)
+            level1 = project_path / 'src' / '1. level1'
+            (level1 / 'new').mkdir()
+            (level1 / 'new' / 'new.rst').touch()
+            (level1 / '2. level2' / 'l2.1.rst').unlink()
+            pages = make_indexes(project_path, cfg, watcher=watcher)
+            expected = make_indexes(project_path, activate_cfg(project_path))
+        finally:
+            watcher.close()
+
+        assert pages == expected
+        assert level1 / 'new' / 'autotoc.new.rst' in pages
+
+    def test_only_affected_pages_are_rendered(
+        self, project_path: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        if not sys.platform.startswith('linux'):
+            pytest.skip('inotify is only available on Linux')
+        cfg = activate_cfg(project_path)
+        watcher = TreeWatcher(project_path, 'inotify')
+        try:
+            make_indexes(project_path, cfg, watcher=watcher)
+            level1 = project_path / 'src' / '1. level1'
+            (level1 / 'new').mkdir()
+            (level1 / 'new' / 'new.rst').touch()
+
+            rendered: List[str] = []
+            add_to_nav = sphinx_autotoc._add_to_nav
+
+            def recording_add_to_nav(node: DirNode, *args: Any) -> Dict[Path, str]:
+                rendered.append(node.path.name)
+                return add_to_nav(node, *args)
+
+            monkeypatch.setattr(sphinx_autotoc, '_add_to_nav', recording_add_to_nav)
+            make_indexes(project_path, cfg, watcher=watcher)
+        finally:
+            watcher.close()
+
+        assert sorted(rendered) == ['1. level1', 'new']
+
+    def test_unwatchable_folder_is_checked(
+        self, project_path: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        if not sys.platform.startswith('linux'):
+            pytest.skip('inotify is only available on Linux')
+        cfg = activate_cfg(project_path)
+        watcher = TreeWatcher(project_path, 'inotify')
+        assert isinstance(watcher.backend, InotifyBackend)
+        libc = watcher.backend._libc
+        add_watch = libc.inotify_add_watch
+
+        def failing_add_watch(fd: int, path: bytes, mask: int) -> int:
+            if os.fsdecode(path).endswith('2. level2'):
+                ctypes.set_errno(errno.ENOSPC)
+                return -1
+            return int(add_watch(fd, path, mask))
+
+        monkeypatch.setattr(libc, 'inotify_add_watch', failing_add_watch)
+        level2 = project_path / 'src' / '1. level1' / '2. level2'
+        try:
+            make_indexes(project_path, cfg, watcher=watcher)
+            # Вторая сборка просматривает папки, отслеживание которых начато после обхода
+            make_indexes(project_path, cfg, watcher=watcher)
+            (level2 / 'new.rst').touch()
+            pages = make_indexes(project_path, cfg, watcher=watcher)
+        finally:
+            watcher.close()
+
+        assert '   new.rst\n' in pages[level2 / 'autotoc.2. level2.rst']
+
+    def test_files_created_before_watching_are_picked_up(
+        self, project_path: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        if not sys.platform.startswith('linux'):
+            pytest.skip('inotify is only available on Linux')
+        cfg = activate_cfg(project_path)
+        watcher = TreeWatcher(project_path, 'inotify')
+        level2 = project_path / 'src' / '1. level1' / '2. level2'
+        sync = watcher.sync
+
+        def late_sync(dir_records: Dict[str, DirRecord]) -> None:
+            (level2 / 'late.rst').touch()
+            sync(dir_records)
+
+        monkeypatch.setattr(watcher, 'sync', late_sync)
+        try:
+            make_indexes(project_path, cfg, watcher=watcher)
+            pages = make_indexes(project_path, cfg, watcher=watcher)
+        finally:
+            watcher.close()
+
+        assert '   late.rst\n' in pages[level2 / 'autotoc.2. level2.rst']
+
+    def test_unknown_mode(self, project_path: Path) -> None:
+        with pytest.raises(ExtensionError):
+            get_watcher(project_path, 'fsevents')
+
+
+def prepare_search_paths(root: Path, file_list: List[str], folder_list: List[str]) -> DirNode:
+    src = root / 'src'
+    src.mkdir()
+    for folder in folder_list:
+        (src / folder).mkdir()
+        (src / folder / 'file.rst').touch()
+    for file in file_list:
+        (src / file).touch()
+    return _scan_tree(root, [], ['.rst'])
 
 
 class TestMakeSearchPaths:
     def test_search_paths_add_files(self, tmp_path: Path) -> None:
-        full_file_list = prepare_search_paths(tmp_path, ['file.rst'], [])
-        search_paths = _make_search_paths(tmp_path, full_file_list)
-        assert search_paths == [Path('file.rst')]
+        node = prepare_search_paths(tmp_path, ['file.rst'], [])
+        search_paths = _make_search_paths(node)
+        assert search_paths == ['file.rst']
 
     def test_search_paths_ignore_autotoc_of_current_folder(self, tmp_path: Path) -> None:
-        full_file_list = prepare_search_paths(tmp_path, [f'autotoc.{tmp_path.name}.rst'], [])
+        node = prepare_search_paths(tmp_path, ['autotoc.src.rst'], [])
 
-        search_paths = _make_search_paths(tmp_path, full_file_list)
-        assert Path(f'autotoc.{tmp_path.name}.rst') not in search_paths
+        search_paths = _make_search_paths(node)
+        assert 'autotoc.src.rst' not in search_paths
 
     def test_search_paths_add_folders(self, tmp_path: Path) -> None:
-        full_file_list = prepare_search_paths(tmp_path, [], ['folder1'])
+        node = prepare_search_paths(tmp_path, [], ['folder1'])
 
-        search_paths = _make_search_paths(tmp_path, full_file_list)
-        assert search_paths == [Path('folder1/autotoc.folder1.rst')]
+        search_paths = _make_search_paths(node)
+        assert search_paths == ['folder1/autotoc.folder1.rst']
 
     def test_search_paths_natsorted_order(self, tmp_path: Path) -> None:
-        full_file_list = prepare_search_paths(
-            tmp_path, ['100file.rst', '50file.rst', '200file.rst'], []
-        )
+        node = prepare_search_paths(tmp_path, ['100file.rst', '50file.rst', '200file.rst'], [])
 
-        search_paths = _make_search_paths(tmp_path, full_file_list)
-        assert search_paths == [Path('50file.rst'), Path('100file.rst'), Path('200file.rst')]
+        search_paths = _make_search_paths(node)
+        assert search_paths == ['50file.rst', '100file.rst', '200file.rst']
+
+    def test_search_paths_natsorted_folders(self, tmp_path: Path) -> None:
+        node = prepare_search_paths(tmp_path, [], ['10. b', '2. a', '1. c'])
+
+        search_paths = _make_search_paths(node)
+        assert [path.split('/')[0] for path in search_paths] == ['1. c', '2. a', '10. b']
 
     def test_search_paths_folders_before_files(self, tmp_path: Path) -> None:
-        full_file_list = prepare_search_paths(
-            tmp_path, ['file1.rst', 'file2.rst'], ['folder1', 'folder2']
-        )
+        node = prepare_search_paths(tmp_path, ['file1.rst', 'file2.rst'], ['folder1', 'folder2'])
 
-        search_paths = _make_search_paths(tmp_path, full_file_list)
+        search_paths = _make_search_paths(node)
         assert search_paths == [
-            Path(item)
-            for item in [
-                'folder1/autotoc.folder1.rst',
-                'folder2/autotoc.folder2.rst',
-                'file1.rst',
-                'file2.rst',
-            ]
+            'folder1/autotoc.folder1.rst',
+            'folder2/autotoc.folder2.rst',
+            'file1.rst',
+            'file2.rst',
         ], 'Папки должны идти в содержании раньше файлов'
 
 
@@ -294,6 +966,34 @@ class TestListFiles:
         expected = {Path(item) for item in ['src', 'src/folder1', 'src/folder1/1.rst']}
         assert _list_files(tmp_path, [], ['.rst']) == expected
 
+    def test_list_files_nested_underscored_and_hidden_subdirs(self, tmp_path: Path) -> None:
+        setup_list_files_dir(
+            tmp_path,
+            ['folder1', '_build/html', '.git/objects', 'folder1/_autosummary/inner'],
+            [
+                'folder1/1.rst',
+                '_build/html/2.rst',
+                '.git/3.rst',
+                'folder1/_autosummary/inner/4.rst',
+            ],
+        )
+        expected = {Path(item) for item in ['src', 'src/folder1', 'src/folder1/1.rst']}
+        assert _list_files(tmp_path, [], ['.rst']) == expected
+
+    def test_list_files_excluded_folder_subtree(self, tmp_path: Path) -> None:
+        setup_list_files_dir(
+            tmp_path, ['folder1', 'vendor/inner'], ['folder1/1.rst', 'vendor/inner/2.rst']
+        )
+        expected = {Path(item) for item in ['src', 'src/folder1', 'src/folder1/1.rst']}
+        assert _list_files(tmp_path, ['src/vendor'], ['.rst']) == expected
+
+    def test_list_files_only_src(self, tmp_path: Path) -> None:
+        setup_list_files_dir(tmp_path, [], ['1.rst'])
+        (tmp_path / 'outside').mkdir()
+        (tmp_path / 'outside' / '2.rst').touch()
+        (tmp_path / '3.rst').touch()
+        assert _list_files(tmp_path, [], ['.rst']) == {Path('src'), Path('src/1.rst')}
+
     @pytest.mark.parametrize(
         'folders, files, exclude_patterns, expected',
         [
@@ -360,6 +1060,12 @@ class TestListFiles:
         expected_paths = {Path('src', item) for item in expected}
         assert _list_files(tmp_path, exclude_patterns, ['.rst']) == expected_paths
 
+    def test_list_files_symlinked_folder_is_not_followed(self, tmp_path: Path) -> None:
+        setup_list_files_dir(tmp_path, ['folder1'], ['folder1/1.rst'])
+        (tmp_path / 'src' / 'link').symlink_to(tmp_path / 'src' / 'folder1')
+        expected = {Path(item) for item in ['src', 'src/folder1', 'src/folder1/1.rst']}
+        assert _list_files(tmp_path, [], ['.rst']) == expected
+
     @pytest.mark.parametrize(
         'source_suffixes, result',
         [
@@ -377,3 +1083,74 @@ class TestListFiles:
         setup_list_files_dir(tmp_path, [], ['1.rst', '2.md', '3.txt', '4.doc'])
         expected = {Path('src', item) for item in result}
         assert _list_files(tmp_path, [], source_suffixes) == expected
+
+
+class TestExcludeMatcher:
+    patterns = [
+        'src/exact.rst',
+        'src/dir',
+        'src/*/skip.rst',
+        'src/a*',
+        '**/drafts',
+        '**/*.tmp.rst',
+        'src/[xy].rst',
+        'src/[!z]z.rst',
+        'src/level?/**',
+    ]
+    paths = [
+        'src/exact.rst',
+        'src/exact.rst.bak',
+        'src/dir',
+        'src/dir/file.rst',
+        'src/one/skip.rst',
+        'src/one/two/skip.rst',
+        'src/abc.rst',
+        'src/b/abc.rst',
+        'drafts',
+        'src/deep/drafts',
+        'src/page.tmp.rst',
+        'src/x.rst',
+        'src/z.rst',
+        'src/az.rst',
+        'src/zz.rst',
+        'src/level1/page.rst',
+        'src/level10/page.rst',
+    ]
+
+    def test_matches_like_sphinx_matcher(self) -> None:
+        expected = Matcher(self.patterns)
+        matcher = ExcludeMatcher(self.patterns)
+        for path in self.paths:
+            assert matcher(path) == expected(path), path
+            directory, name = path.rsplit('/', 1) if '/' in path else ('', path)
+            if directory:
+                assert matcher.match_file(directory, name) == expected(path), path
+
+    def test_no_patterns(self) -> None:
+        matcher = ExcludeMatcher([])
+        assert not matcher('src/page.rst')
+        assert not matcher.match_file('src', 'page.rst')
+
+
+class TestScanTree:
+    def test_scan_tree_structure(self, tmp_path: Path) -> None:
+        setup_list_files_dir(
+            tmp_path,
+            ['b/inner', 'a', 'empty'],
+            ['root.rst', 'a/1.rst', 'b/2.rst', 'b/inner/3.rst', 'b/skip.txt'],
+        )
+        tree = _scan_tree(tmp_path, [], ['.rst'])
+        assert tree.files == ['root.rst']
+        assert sorted(child.path.name for child in tree.dirs) == ['a', 'b']
+
+    def test_iter_dirs_order(self, tmp_path: Path) -> None:
+        setup_list_files_dir(
+            tmp_path, ['10. b/inner', '2. a'], ['10. b/inner/1.rst', '2. a/2.rst', '10. b/3.rst']
+        )
+        tree = _scan_tree(tmp_path, [], ['.rst'])
+        assert [node.path.relative_to(tmp_path).as_posix() for node in _iter_dirs(tree)] == [
+            'src',
+            'src/2. a',
+            'src/10. b',
+            'src/10. b/inner',
+        ]